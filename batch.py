@@ -0,0 +1,224 @@
+'''
+Constraint propagation over many puzzles at once with NumPy.
+
+A batch of N puzzles is held as a boolean candidate tensor of shape
+(N, cells, size). Naked singles (a solved cell removes its digit from its
+peers) and hidden singles (a digit with one place left in a unit goes there)
+are applied to the whole batch as array operations until nothing changes.
+
+The puzzles propagation leaves unsolved are searched as one batch too. Every
+open search state branches on its cell with the fewest candidates, into one
+child state per candidate, and all the children are propagated together.
+States are dropped once their puzzle is solved. Only a puzzle whose states
+outgrow SEARCH_STATES (nearly empty grids) is handed to a search-based
+solver, one by one.
+'''
+
+from itertools import islice
+
+import numpy as np
+
+from sudoku import HEX_REP, ProSolver, digit_table, puzzle_size, solve_puzzle
+from topology import topology
+
+# Puzzles propagated together; bounds memory for large inputs.
+CHUNK = 4096
+
+# Open search states a puzzle may have at once before it is given to the
+# fallback solver instead.
+SEARCH_STATES = 256
+
+# Digit -> character code ('.' for 0).
+SYMBOLS = np.array([ord(HEX_REP.get(d, '.')) for d in range(256)], dtype=np.uint8)
+
+try:
+    popcount = np.bitwise_count
+except AttributeError:  # NumPy < 2.0
+    def popcount(a):
+        n = np.zeros(a.shape, dtype=np.uint8)
+        for k in range(a.dtype.itemsize * 8):
+            n += (a >> k & 1).astype(np.uint8)
+        return n
+
+
+class Propagator:
+    """The index arrays propagate() needs for one size, built once.
+
+    Inside propagate() the digit axis of the candidate tensor is packed into
+    one unsigned integer per cell (bit d - 1 for digit d). Units are then
+    reduced with bitwise OR instead of gathering (N, units, size, size)
+    boolean blocks, which is about 15 times faster on 9x9."""
+
+    def __init__(self, size):
+        t = topology(size)
+        self.size = size
+        self.cells = t.cells
+        self.full = t.full
+        self.digits = np.frombuffer(digit_table(size), dtype=np.uint8)
+        self.dtype = np.uint16 if size <= 16 else np.uint32 if size <= 32 else np.uint64
+        self.bits = np.left_shift(1, np.arange(size)).astype(self.dtype)
+        self.units = np.array(t.units, dtype=np.intp)           # (3 * size, size)
+        # Unit ids of each cell's row, column and box.
+        self.rows = np.array(t.rows, dtype=np.intp)
+        self.cols = np.array(t.cols, dtype=np.intp) + size
+        self.boxes = np.array(t.boxes, dtype=np.intp) + 2 * size
+
+    def candidates(self, puzzles):
+        "The (N, cells, size) candidate tensor of a list of puzzle strings."
+        codes = np.frombuffer(''.join(puzzles).encode('ascii'), dtype=np.uint8)
+        return self.candidates_of(self.digits[codes].reshape(len(puzzles), self.cells))
+
+    def candidates_of(self, digits):
+        "The candidate tensor of an (N, cells) array of digits, 0 for empty."
+        values = np.arange(1, self.size + 1, dtype=digits.dtype)
+        return (digits[:, :, None] == 0) | (digits[:, :, None] == values)
+
+    def pack(self, cand):
+        return (cand * self.bits).sum(axis=2, dtype=self.dtype)
+
+    def unpack(self, masks):
+        return (masks[:, :, None] & self.bits) != 0
+
+    def in_units(self, per_unit):
+        "OR of a (N, units) array over the row, column and box of each cell."
+        return per_unit[:, self.rows] | per_unit[:, self.cols] | per_unit[:, self.boxes]
+
+    def propagate(self, cand):
+        """Apply naked and hidden singles to every puzzle until a fixpoint.
+        cand is updated in place. Return a boolean mask of the puzzles that
+        are still consistent."""
+        masks = self.pack(cand)
+        ok = self.propagate_masks(masks)
+        cand[...] = self.unpack(masks)
+        return ok
+
+    def propagate_masks(self, masks):
+        "propagate() on an (N, cells) array of packed candidate masks."
+        ok = np.ones(len(masks), dtype=bool)
+        active = np.arange(len(masks))
+        while len(active):
+            m = masks[active]
+            count = popcount(m)
+            before = count.sum(axis=1, dtype=np.int32)
+
+            # Naked singles: drop a solved cell's digit from all its peers.
+            # Two solved cells of a unit holding the same digit show up as
+            # fewer bits in the unit's OR than solved cells in the unit.
+            single = np.where(count == 1, m, 0).astype(self.dtype)
+            per_unit = single[:, self.units]                    # (n, units, size)
+            placed = np.bitwise_or.reduce(per_unit, axis=2)
+            dead = popcount(placed).sum(axis=1, dtype=np.int32) != \
+                np.count_nonzero(per_unit, axis=(1, 2))
+            m = np.where(single != 0, m, m & ~self.in_units(placed))
+
+            # Hidden singles: a digit with one place left in a unit goes there.
+            per_unit = m[:, self.units]
+            once = np.zeros(per_unit.shape[:2], dtype=self.dtype)
+            twice = np.zeros_like(once)
+            for k in range(self.size):
+                twice |= once & per_unit[:, :, k]
+                once |= per_unit[:, :, k]
+            dead |= (once != self.full).any(axis=1)             # Digit with no place
+            hidden = m & self.in_units(once & ~twice)
+            m = np.where(hidden != 0, hidden, m)
+
+            dead |= (m == 0).any(axis=1)
+            masks[active] = m
+            ok[active[dead]] = False
+
+            after = popcount(m).sum(axis=1, dtype=np.int32)
+            active = active[~dead & (after != before)]
+        return ok
+
+    def search(self, masks, limit=SEARCH_STATES):
+        """Search the propagated (N, cells) masks of N puzzles, all at once.
+        Return the solved masks (one solution each) and a status per puzzle:
+        1 solved, 0 no solution, -1 given up after more than limit open
+        states."""
+        n = len(masks)
+        solved = np.zeros_like(masks)
+        status = np.zeros(n, dtype=np.int8)
+        unsolved = np.ones(n, dtype=bool)
+        states, owner = masks, np.arange(n)
+        while len(states):
+            count = popcount(states)
+            done = (count == 1).all(axis=1)
+            if done.any():
+                # The first solved state of each puzzle still open.
+                first, at = np.unique(owner[done], return_index=True)
+                at = at[unsolved[first]]
+                first = first[unsolved[first]]
+                solved[first] = states[done][at]
+                status[first] = 1
+                unsolved[first] = False
+
+            keep = ~done & unsolved[owner]
+            many = np.bincount(owner[keep], minlength=n) > limit
+            if many.any():
+                status[many] = -1
+                unsolved[many] = False
+                keep &= ~many[owner]
+            states, owner, count = states[keep], owner[keep], count[keep]
+            if not len(states):
+                break
+
+            # One child per candidate of the open cell with the fewest.
+            cell = np.where(count > 1, count, 255).argmin(axis=1)
+            branch = states[np.arange(len(states)), cell]
+            parent, bit = np.nonzero((branch[:, None] & self.bits) != 0)
+            states = states[parent]
+            states[np.arange(len(parent)), cell[parent]] = self.bits[bit]
+            owner = owner[parent]
+
+            ok = self.propagate_masks(states)
+            states, owner = states[ok], owner[ok]
+        return solved, status
+
+    def strings(self, cand):
+        "Puzzle strings with every cell left with one candidate filled in."
+        single = cand.sum(axis=2) == 1
+        digits = np.where(single, cand.argmax(axis=2) + 1, 0).astype(np.uint8)
+        return [row.tobytes().decode('ascii') for row in SYMBOLS[digits]]
+
+
+_PROPAGATORS = {}
+
+
+def propagator(size):
+    "Return the memoized Propagator for boards of the given size."
+    try:
+        return _PROPAGATORS[size]
+    except KeyError:
+        p = _PROPAGATORS[size] = Propagator(size)
+        return p
+
+
+def solve_batch(puzzles, solver=ProSolver, size=None, chunk=CHUNK):
+    """Solve an iterable of puzzle strings, propagating and searching CHUNK of
+    them at a time. Yields one solution string per puzzle, in input order, or
+    None when a puzzle has no solution. Puzzles the batched search gives up
+    on go to `solver`, starting from the cells propagation already fixed."""
+    puzzles = iter(puzzles)
+    while True:
+        block = list(islice(puzzles, chunk))
+        if not block:
+            return
+
+        size = size or puzzle_size(block[0])
+        p = propagator(size)
+        masks = p.pack(p.candidates(block))
+        ok = p.propagate_masks(masks)
+        status = np.where(ok, 1, 0).astype(np.int8)
+        left = np.flatnonzero(ok & (popcount(masks) != 1).any(axis=1))
+        if len(left):
+            found, status[left] = p.search(masks[left])
+            masks[left[status[left] == 1]] = found[status[left] == 1]
+
+        strings = p.strings(p.unpack(masks))
+        for puzzle, s in zip(strings, status.tolist()):
+            if s == 1:
+                yield puzzle
+            elif s == 0:
+                yield None
+            else:
+                yield solve_puzzle(puzzle, solver, size, 'batch.cnf')
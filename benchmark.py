@@ -1,91 +1,234 @@
+'''
+Solver benchmarks.
+
+Every solver runs on every puzzle of a corpus: first `warmup` untimed runs,
+then `repeats` runs timed with perf_counter_ns around solve(). The samples of
+each solver are summarized as min/median/p95/p99 and can be saved as JSON or
+CSV, and compared against a saved JSON baseline to flag regressions. Nothing
+here needs a display; plotting imports matplotlib only when it is asked for.
+
+    python benchmark.py --size 9 --difficulty hard --solvers pro,dlx,sat \\
+        --json results.json --compare baseline.json
+'''
+
 from __future__ import print_function
-import matplotlib.pyplot as plt
+import argparse
+import csv
+import json
+import platform
+import sys
+import time
+
 import numpy as np
+
+from decorators import quiet
+from main import SOLVERS, load_solver
 from sudoku import *
+from validate import check
 
+# Solvers run when none are named; the naive one can take seconds a puzzle.
+DEFAULT_SOLVERS = ('pro', 'sat', 'dlx')
 
-class Benchmark:
-    def __init__(self):
-        self.easy9_solver1_times = []
-        self.easy9_solver2_times = []
-        self.easy9_solver3_times = []
+# Reported statistics, in milliseconds.
+STATS = ('min', 'median', 'p95', 'p99', 'mean')
 
-        self.hard9_solver1_times = []
-        self.hard9_solver2_times = []
-        self.hard9_solver3_times = []
+# A median or p95 this much slower than the baseline is a regression.
+TOLERANCE = 0.10
 
-        self.easy16_solver1_times = []
-        self.easy16_solver2_times = []
-        self.easy16_solver3_times = []
 
-        self.hard16_solver1_times = []
-        self.hard16_solver2_times = []
-        self.hard16_solver3_times = []
+def corpus(source='builtin', size=9, difficulty='hard', count=100, seed=0):
+    """The puzzles to benchmark: 'builtin' (the puzzles in Sudoku, difficulty
+    'easy', 'hard' or 'all'), 'generated' (count puzzles from generate.py,
+    difficulty 'easy', 'medium' or 'hard'), or the path of a puzzle file."""
+    if source == 'builtin':
+        sudoku = Sudoku(size)
+        return {'easy': sudoku.easy, 'hard': sudoku.hard,
+                'all': sudoku.easy + sudoku.hard}[difficulty]
+    elif source == 'generated':
+        from generate import generate
+        return list(generate(count, size, difficulty, workers=0, seed=seed))
+    else:
+        from stream import read_puzzles
+        return list(read_puzzles(source))
 
-        self.times = {
-            'easy91': self.easy9_solver1_times,
-            'easy92': self.easy9_solver2_times,
-            'easy93': self.easy9_solver3_times,
 
-            'hard91': self.hard9_solver1_times,
-            'hard92': self.hard9_solver2_times,
-            'hard93': self.hard9_solver3_times,
+def summarize(samples):
+    "The STATS of a list of nanosecond timings, in milliseconds."
+    ms = np.array(samples, dtype=np.float64) / 1e6
+    return {'min': float(ms.min()), 'median': float(np.median(ms)),
+            'p95': float(np.percentile(ms, 95)), 'p99': float(np.percentile(ms, 99)),
+            'mean': float(ms.mean())}
 
-            'easy161': self.easy16_solver1_times,
-            'easy162': self.easy16_solver2_times,
-            'easy163': self.easy16_solver3_times,
 
-            'hard161': self.hard16_solver1_times,
-            'hard162': self.hard16_solver2_times,
-            'hard163': self.hard16_solver3_times
-        }
+def clear_caches():
+    """Empty the solution cache, if CachingSolver has loaded it, so that a
+    repeat never times a hit on the answer of the run before."""
+    canonical = sys.modules.get('canonical')
+    if canonical is not None:
+        canonical.solution_cache().clear()
 
-    def time(self, dif='hard', size=9):
-        sudoku = Sudoku(size)
 
-        problem_set = sudoku.easy if dif != 'hard' else sudoku.hard
+def run(puzzles, solvers=DEFAULT_SOLVERS, warmup=1, repeats=5, size=None):
+    """Time each named solver on every puzzle. Return the results as a dict:
+    'meta' describes the run, 'solvers' holds the statistics of each solver
+    (plus its sample and failure counts, the wrong solutions validate.check
+    found among the timed ones, and its mean search nodes per solve) and
+    'puzzles' the median time of each puzzle, in milliseconds. The solution
+    cache is emptied before every solve, so 'cached' is timed on misses."""
+    size = size or puzzle_size(puzzles[0])
+    results = {'meta': {'size': size, 'puzzles': len(puzzles), 'warmup': warmup,
+                        'repeats': repeats, 'python': platform.python_version(),
+                        'machine': platform.machine(),
+                        'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+               'solvers': {}, 'puzzles': {}}
 
-        for i, p in enumerate(problem_set):
-            g = Grid(p, size)
-            naive_solver = NaiveSolver(g, size, '')
-            pro_solver = ProSolver(g, size, '')
-            sat_solver = SATSolver(
-                g, size, '{}{}_{}.cnf'.format(dif, str(size), str(i)))
+    spots = topology(size).spots
+    with quiet():
+        for name in solvers:
+            solver = load_solver(name)
+            samples, medians, failed, nodes = [], [], 0, 0
+            solutions, givens = [], []
+            for i, p in enumerate(puzzles):
+                grid = Grid(p, size)
+                filename = 'bench{}_{}.cnf'.format(size, i)
+                for _ in range(warmup):
+                    clear_caches()
+                    solver(grid, size, filename).solve()
 
-            t1, _ = naive_solver.solve()
-            t2, _ = pro_solver.solve()
-            t3, _ = sat_solver.solve()
+                times = []
+                for _ in range(repeats):
+                    clear_caches()
+                    s = solver(grid, size, filename)
+                    t = time.perf_counter_ns()
+                    _, solved = s.solve()
+                    times.append(time.perf_counter_ns() - t)
+                    failed += not solved
+                    nodes += s.stats.nodes
+                    if solved:
+                        solutions.append(bytearray(s.sigma.get(spot, 0) for spot in spots))
+                        givens.append(grid.givens)
+                samples += times
+                medians.append(float(np.median(times)) / 1e6)
 
-            self.times[dif + str(size) + str(1)].append(int(t1 * 1000))
-            self.times[dif + str(size) + str(2)].append(int(t2 * 1000))
-            self.times[dif + str(size) + str(3)].append(int(t3 * 1000))
+            stats = summarize(samples)
+            stats.update(samples=len(samples), failed=failed,
+                         invalid=int((~check(solutions, givens, size)).sum()),
+                         nodes=float(nodes) / len(samples))
+            results['solvers'][name] = stats
+            results['puzzles'][name] = medians
+    return results
 
-    def plot(self, dif='hard', size=9):
-        self.time(dif, size)
 
-        t1 = self.times[dif + str(size) + '1']
-        t2 = self.times[dif + str(size) + '2']
-        t3 = self.times[dif + str(size) + '3']
+def save_json(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_csv(results, path):
+    "One row per solver: its statistics in milliseconds and its counts."
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(('solver',) + STATS + ('samples', 'failed', 'invalid'))
+        for name, stats in sorted(results['solvers'].items()):
+            writer.writerow((name,) + tuple('{:.4f}'.format(stats[k]) for k in STATS) +
+                            (stats['samples'], stats['failed'], stats.get('invalid', 0)))
+
+
+def compare(baseline, results, tolerance=TOLERANCE):
+    """Return the regressions of results against baseline, as (solver,
+    statistic, baseline, now) tuples: a median or p95 more than tolerance
+    slower, more failed solves, or any wrong solution."""
+    regressions = []
+    for name, stats in sorted(results['solvers'].items()):
+        base = baseline['solvers'].get(name)
+        if base is None:
+            continue
+        for k in ('median', 'p95'):
+            if stats[k] > base[k] * (1 + tolerance):
+                regressions.append((name, k, base[k], stats[k]))
+        if stats['failed'] > base['failed']:
+            regressions.append((name, 'failed', base['failed'], stats['failed']))
+        if stats.get('invalid', 0) > base.get('invalid', 0):
+            regressions.append((name, 'invalid', base.get('invalid', 0), stats['invalid']))
+    return regressions
+
+
+def report(results, baseline=None):
+    "Print a table of the results, with the change against a baseline."
+    print('{:<18}'.format('solver') + ''.join('{:>10}'.format(k) for k in STATS) +
+          '{:>8}{:>8}{:>10}'.format('failed', 'invalid', 'nodes') +
+          ('{:>10}'.format('vs base') if baseline else ''))
+    for name, stats in sorted(results['solvers'].items()):
+        line = '{:<18}'.format(name) + ''.join('{:>10.3f}'.format(stats[k]) for k in STATS)
+        line += '{:>8}{:>8}{:>10.1f}'.format(stats['failed'], stats.get('invalid', 0),
+                                             stats.get('nodes', 0))
+        base = baseline and baseline['solvers'].get(name)
+        if base:
+            line += '{:>+9.1f}%'.format((stats['median'] / base['median'] - 1) * 100)
+        print(line)
+
 
-        ind = np.arange(len(t2))  # the x locations for the groups
-        width = 0.2  # the width of the bars
+def profile(puzzles, solver='pro', size=None, sort='cumulative', limit=25, path=None):
+    """Run a solver over the puzzles under cProfile, profiling only the
+    solve() calls, and print the top `limit` functions by `sort`. With path,
+    the raw profile is also saved there for pstats or a viewer."""
+    import cProfile
+    import pstats
 
-        fig, ax = plt.subplots()
+    size = size or puzzle_size(puzzles[0])
+    profiler = cProfile.Profile()
+    solver = load_solver(solver)
+    with quiet():
+        for p in puzzles:
+            s = solver(Grid(p, size), size, 'profile.cnf')
+            profiler.enable()
+            s.solve()
+            profiler.disable()
 
-        rects1 = ax.bar(ind - width, t1, width,
-                        color='b', label='Naive Solver')
-        rects2 = ax.bar(ind, t2, width,
-                        color='r', label='Pro Solver')
-        rects3 = ax.bar(ind + width, t3, width,
-                        color='g', label='SAT Solver')
+    pstats.Stats(profiler).sort_stats(sort).print_stats(limit)
+    if path:
+        profiler.dump_stats(path)
+    return profiler
 
-        # Add some text for labels, title and custom x-axis tick labels, etc.
-        ax.set_ylabel('Time (miliseconds)')
-        ax.set_title('{} Problems {}'.format(
-            dif.upper(), '{}X{}'.format(str(size), str(size))))
-        ax.legend()
 
-        plt.show()
+def plot(results, title=''):
+    "Bar chart of the median time per puzzle of each solver (needs matplotlib)."
+    import matplotlib.pyplot as plt
+
+    colors = 'brgyc'
+    names = sorted(results['puzzles'])
+    width = 0.8 / len(names)
+    fig, ax = plt.subplots()
+    for k, name in enumerate(names):
+        t = results['puzzles'][name]
+        ind = np.arange(len(t)) + (k - (len(names) - 1) / 2.0) * width
+        ax.bar(ind, t, width, color=colors[k % len(colors)], label=name)
+
+    ax.set_ylabel('Time (milliseconds)')
+    ax.set_title(title)
+    ax.legend()
+    plt.show()
+
+
+class Benchmark:
+    """Plots the built-in corpora, as before. The naive solver is left out
+    of 16x16 runs, where its hard puzzles only time out."""
+
+    def __init__(self, warmup=1, repeats=3):
+        self.warmup = warmup
+        self.repeats = repeats
+
+    def time(self, dif='hard', size=9):
+        solvers = ('naive',) + DEFAULT_SOLVERS if size == 9 else DEFAULT_SOLVERS
+        return run(corpus('builtin', size, dif), solvers, self.warmup, self.repeats, size)
+
+    def plot(self, dif='hard', size=9):
+        plot(self.time(dif, size), '{} Problems {}X{}'.format(dif.upper(), size, size))
 
     def plot_all(self):
         self.plot('easy', 9)
@@ -93,3 +236,59 @@ class Benchmark:
 
         self.plot('easy', 16)
         self.plot('hard', 16)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--corpus', default='builtin',
+                        help="'builtin', 'generated' or a puzzle file")
+    parser.add_argument('--size', type=int, default=9)
+    parser.add_argument('--difficulty', default='hard')
+    parser.add_argument('--count', type=int, default=100,
+                        help='puzzles to generate for --corpus generated')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--solvers', default=','.join(DEFAULT_SOLVERS),
+                        help='comma-separated, from: ' + ', '.join(sorted(SOLVERS)))
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--json', help='write the results to this JSON file')
+    parser.add_argument('--csv', help='write the summary to this CSV file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='exit with status 1 on regressions against this JSON file')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--plot', action='store_true', help='show a bar chart')
+    parser.add_argument('--profile', action='store_true',
+                        help='profile the solvers with cProfile instead of timing them')
+    parser.add_argument('--profile-out', metavar='FILE',
+                        help='save the raw profile (of the last solver) here')
+    args = parser.parse_args(argv)
+
+    puzzles = corpus(args.corpus, args.size, args.difficulty, args.count, args.seed)
+    if args.profile:
+        for name in args.solvers.split(','):
+            print('====', name)
+            profile(puzzles, name, args.size, path=args.profile_out)
+        return 0
+
+    results = run(puzzles, args.solvers.split(','), args.warmup, args.repeats, args.size)
+    results['meta'].update(corpus=args.corpus, difficulty=args.difficulty)
+
+    baseline = load_json(args.compare) if args.compare else None
+    report(results, baseline)
+    if args.json:
+        save_json(results, args.json)
+    if args.csv:
+        save_csv(results, args.csv)
+    if args.plot:
+        plot(results, '{} {} {}x{}'.format(args.corpus, args.difficulty, args.size, args.size))
+
+    if baseline:
+        regressions = compare(baseline, results, args.tolerance)
+        for name, k, before, now in regressions:
+            print('REGRESSION {} {}: {:.3f} -> {:.3f}'.format(name, k, before, now))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+'''
+Cooperative time and work limits for the solvers.
+
+A Budget is checked by the solvers themselves (once per search node, or
+between SAT solver slices) instead of being enforced with a signal, so it works
+in any thread or worker process and can be cancelled from another thread.
+'''
+
+import time
+
+# Solver.status values.
+SOLVED = 'solved'
+UNSOLVABLE = 'unsolvable'
+TIMEOUT = 'timeout'
+CANCELLED = 'cancelled'
+ERROR = 'error'  # Every engine of a portfolio race raised
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class Budget:
+    """Limits on one solve: a wall-clock timeout in seconds, a maximum number
+    of search nodes and a maximum number of propagations (eliminations for
+    the constraint solvers, PicoSAT propagations for the SAT solver). None
+    means no limit. The counters hold the work done so far."""
+
+    def __init__(self, timeout=None, max_nodes=None, max_propagations=None):
+        self.timeout = timeout
+        self.max_nodes = max_nodes
+        self.max_propagations = max_propagations
+        self.cancelled = False
+        self.start()
+
+    def start(self):
+        "Reset the counters and start the clock."
+        self.nodes = 0
+        self.propagations = 0
+        self.exceeded = None  # Which limit stopped the solve, if any
+        self.deadline = None if self.timeout is None else \
+            time.monotonic() + self.timeout
+
+    def cancel(self):
+        "Ask the solver using this budget to stop. Safe to call from any thread."
+        self.cancelled = True
+
+    def remaining(self):
+        "Seconds left before the deadline, or None without a timeout."
+        if self.deadline is None:
+            return None
+        return max(0., self.deadline - time.monotonic())
+
+    def node(self):
+        """Count one search node and raise BudgetExceeded if a limit is hit.
+        The clock and the cancel flag are only looked at every 64 nodes."""
+        self.nodes += 1
+        if self.max_nodes is not None and self.nodes > self.max_nodes:
+            self.stop('nodes')
+        if self.max_propagations is not None and \
+                self.propagations > self.max_propagations:
+            self.stop('propagations')
+        if not self.nodes & 63:
+            self.check()
+
+    def check(self):
+        "Raise BudgetExceeded if cancelled or past the deadline."
+        if self.cancelled:
+            self.stop('cancelled')
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.stop('time')
+
+    def expired(self):
+        "Same test as check(), without raising (for callbacks from C)."
+        return self.cancelled or \
+            (self.deadline is not None and time.monotonic() > self.deadline)
+
+    def stop(self, reason):
+        self.exceeded = reason
+        raise BudgetExceeded(reason)
+
+    def status(self):
+        "The solver status to report once this budget stopped a solve."
+        return CANCELLED if self.exceeded == 'cancelled' else TIMEOUT
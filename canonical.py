@@ -0,0 +1,200 @@
+'''
+Canonical forms of puzzles under the Sudoku symmetries, and an LRU cache of
+solutions keyed by them.
+
+Relabeling the digits, permuting bands, stacks, the rows inside a band or the
+columns inside a stack, and transposing all turn a puzzle into an equivalent
+one. canonical_form() picks one representative of such a class: rows and
+columns are first ordered by invariants that the symmetries preserve (refined
+as in colour refinement), the remaining ties are tried exhaustively up to
+MAX_TIES arrangements, and the lexicographically smallest result, with digits
+renumbered by first occurrence, is kept. Past MAX_TIES two equivalent puzzles
+may get different forms; that only costs a cache miss, never a wrong answer,
+since the Transform returned with a form always maps it back exactly.
+'''
+
+import threading
+from collections import OrderedDict
+from itertools import groupby, islice, permutations, product
+from topology import topology
+
+# Tie-breaking arrangements tried per orientation, for rows and columns each.
+MAX_TIES = 24
+
+# Canonical puzzles kept by the process-wide cache.
+CACHE_SIZE = 1 << 16
+
+
+class Transform:
+    """Maps a canonical board back to the puzzle it came from: where[cell] is
+    the canonical cell of each original cell, digits[d] the original digit of
+    canonical digit d."""
+    __slots__ = ('where', 'digits')
+
+    def __init__(self, where, digits):
+        self.where = where
+        self.digits = digits
+
+    def restore(self, board):
+        "The original-order digits of a board given in canonical order."
+        digits = self.digits
+        return bytes(bytearray(digits[board[w]] for w in self.where))
+
+
+def refine(grid, size, box):
+    """Colour the rows and columns of a grid (digits in cell order, 0 for
+    empty) with invariants of the symmetries, refined until stable."""
+    cells = [(c // size, c % size, d) for c, d in enumerate(grid) if d]
+    count = [0] * (size + 1)
+    for _, _, d in cells:
+        count[d] += 1
+
+    rows, cols, digits = [0] * size, [0] * size, count
+    classes = 0
+    while True:
+        in_row = [[] for _ in range(size)]
+        in_col = [[] for _ in range(size)]
+        of_digit = [[] for _ in range(size + 1)]
+        for r, c, d in cells:
+            in_row[r].append((cols[c], digits[d]))
+            in_col[c].append((rows[r], digits[d]))
+            of_digit[d].append((rows[r], cols[c]))
+
+        band = [tuple(sorted(rows[r - r % box:r - r % box + box])) for r in range(size)]
+        stack = [tuple(sorted(cols[c - c % box:c - c % box + box])) for c in range(size)]
+        rows = compress([(rows[r], band[r], tuple(sorted(in_row[r])))
+                         for r in range(size)])
+        cols = compress([(cols[c], stack[c], tuple(sorted(in_col[c])))
+                         for c in range(size)])
+        digits = compress([(digits[d], tuple(sorted(of_digit[d])))
+                           for d in range(size + 1)])
+
+        n = len(set(rows)) + len(set(cols)) + len(set(digits))
+        if n == classes:
+            return rows, cols
+        classes = n
+
+
+def compress(keys):
+    "Replace each key by its rank among the distinct keys."
+    rank = dict((k, i) for i, k in enumerate(sorted(set(keys))))
+    return [rank[k] for k in keys]
+
+
+def arrangements(colours, box):
+    """Orders of the rows (or columns) consistent with their colours: bands
+    sorted by the colours of their rows, rows sorted inside a band, every
+    order of equally coloured bands and rows tried, at most MAX_TIES."""
+    bands = [sorted(range(b * box, b * box + box), key=colours.__getitem__)
+             for b in range(box)]
+    key = [[colours[r] for r in band] for band in bands]
+    band_ties = [list(g) for _, g in groupby(sorted(range(box), key=key.__getitem__),
+                                             key=key.__getitem__)]
+    row_ties = [[list(g) for _, g in groupby(band, key=colours.__getitem__)]
+                for band in bands]
+
+    choices = [permutations(g) for g in band_ties]
+    for b in range(box):
+        choices += [permutations(g) for g in row_ties[b]]
+
+    for combo in islice(product(*choices), MAX_TIES):
+        order = [b for perm in combo[:len(band_ties)] for b in perm]
+        rest = iter(combo[len(band_ties):])
+        inside = [[r for _ in row_ties[b] for r in next(rest)] for b in range(box)]
+        yield [r for b in order for r in inside[b]]
+
+
+def canonical_form(givens, size):
+    """Return the canonical form of a puzzle, as bytes of digits in cell order
+    (0 for empty), and the Transform mapping it back to the puzzle."""
+    t = topology(size)
+    best = None
+    for transposed in (False, True):
+        if transposed:
+            grid = [givens[c % size * size + c // size] for c in range(t.cells)]
+        else:
+            grid = givens
+        rows, cols = refine(grid, size, t.box)
+        col_orders = list(arrangements(cols, t.box))
+        for row_order in arrangements(rows, t.box):
+            for col_order in col_orders:
+                source = [r * size + c for r in row_order for c in col_order]
+                relabel = [0] * (size + 1)
+                form = bytearray(t.cells)
+                n = 0
+                for k, c in enumerate(source):
+                    d = grid[c]
+                    if d:
+                        if not relabel[d]:
+                            n += 1
+                            relabel[d] = n
+                        form[k] = relabel[d]
+                if best is None or form < best[0]:
+                    best = (form, transposed, source, relabel)
+
+    form, transposed, source, relabel = best
+    where = [0] * t.cells
+    for k, c in enumerate(source):
+        where[c % size * size + c // size if transposed else c] = k
+
+    # Digits missing from the puzzle take the remaining labels in order.
+    n = max(relabel)
+    digits = [0] * (size + 1)
+    for d in range(1, size + 1):
+        if not relabel[d]:
+            n += 1
+            relabel[d] = n
+        digits[relabel[d]] = d
+    return bytes(form), Transform(where, digits)
+
+
+class SolutionCache:
+    """A bounded LRU mapping of canonical puzzle -> canonical solution (None
+    for a puzzle known to have no solution). Safe to share between threads."""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def lookup(self, key):
+        "Return (True, solution) for a cached key, else (False, None)."
+        with self.lock:
+            try:
+                solution = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, solution
+
+    def store(self, key, solution):
+        with self.lock:
+            self.entries[key] = solution
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self.entries),
+                'maxsize': self.maxsize}
+
+
+_cache = None
+
+
+def solution_cache():
+    "Return this process's shared SolutionCache."
+    global _cache
+    if _cache is None:
+        _cache = SolutionCache()
+    return _cache
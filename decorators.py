@@ -1,36 +1,50 @@
-import signal
+import threading
 import time
+from contextlib import contextmanager
 
+# Set to False to silence the timing report (e.g. in worker processes).
+verbose = True
 
-class TimedOutExc(Exception):
-    pass
+_local = threading.local()
 
 
-def deadline(timeout, *args):
-    def decorate(f):
-        def handler(signum, frame):
-            raise TimedOutExc()
-
-        def new_f(*args):
-            signal.signal(signal.SIGALRM, handler)
-            signal.alarm(timeout)
-            return f(*args)
-            signa.alarm(0)
-        new_f.__name__ = f.__name__
-        return new_f
-    return decorate
+@contextmanager
+def quiet():
+    """Silence the timing report of solves in this thread for the block.
+    Other threads are not affected, unlike when setting verbose."""
+    depth = getattr(_local, 'quiet', 0)
+    _local.quiet = depth + 1
+    try:
+        yield
+    finally:
+        _local.quiet = depth
 
 
 def time_deco(f):
-    def decorated(*args):
-        t = time.time()
-        try:
-            result = f(*args)
-            t = time.time() - t
+    def decorated(*args, **kwargs):
+        t = time.perf_counter()
+        result = f(*args, **kwargs)
+        t = time.perf_counter() - t
+        stats = getattr(args[0], 'stats', None) if args else None
+        if stats is not None:
+            stats.finish(args[0], t)
+        if verbose and not getattr(_local, 'quiet', 0):
             print('\nExecution time: %s seconds\n' % str(t))
-            return (t, result)
+        return (t, result)
+    decorated.__name__ = f.__name__
+    decorated.__doc__ = f.__doc__
+    return decorated
 
-        except:
-            print('\nEXCEEDED LIMIT: 5 Seconds\n')
-            return(5., False)
+
+def stats_deco(f):
+    """Finish the solver's stats after f, as time_deco does, but return f's
+    result unchanged and print nothing. For searches such as count()."""
+    def decorated(*args, **kwargs):
+        t = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            args[0].stats.finish(args[0], time.perf_counter() - t)
+    decorated.__name__ = f.__name__
+    decorated.__doc__ = f.__doc__
     return decorated
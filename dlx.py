@@ -0,0 +1,194 @@
+'''
+Dancing Links (Knuth's Algorithm X) exact-cover matrix for Sudoku.
+
+Row size * cell + d - 1 of the matrix places digit d in the cell and covers
+four columns: the cell itself, digit d in its row, in its column and in its
+box. The links are kept in flat lists (node 0 is the root, nodes 1..columns
+the column headers), built once per size and reused: a puzzle covers the rows
+of its givens, runs the search, then uncovers everything in reverse order.
+'''
+
+import threading
+from topology import topology
+
+
+class ExactCover:
+    def __init__(self, size):
+        t = topology(size)
+        n = t.cells
+        self.size = size
+        self.columns = columns = 4 * n
+        self.first = first = columns + 1  # First node of matrix row 0
+        self.lock = threading.Lock()
+
+        # Column headers form a circular list around the root.
+        self.L = L = [i - 1 for i in range(columns + 1)]
+        self.R = R = [i + 1 for i in range(columns + 1)]
+        L[0], R[columns] = columns, 0
+        self.U = U = list(range(columns + 1))
+        self.D = D = list(range(columns + 1))
+        self.C = C = list(range(columns + 1))
+        self.S = S = [0] * (columns + 1)
+
+        for cell in range(n):
+            r, c, b = t.rows[cell], t.cols[cell], t.boxes[cell]
+            for d in range(size):
+                node = len(C)
+                assert node == first + 4 * (size * cell + d)
+                for k, col in enumerate((cell, n + r * size + d,
+                                         2 * n + c * size + d,
+                                         3 * n + b * size + d)):
+                    col += 1
+                    L.append(node + (k - 1) % 4)
+                    R.append(node + (k + 1) % 4)
+                    U.append(U[col])
+                    D.append(col)
+                    C.append(col)
+                    D[U[col]] = node + k
+                    U[col] = node + k
+                    S[col] += 1
+
+    def cover(self, c):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        R[L[c]] = R[c]
+        L[R[c]] = L[c]
+        i = D[c]
+        while i != c:
+            j = R[i]
+            while j != i:
+                D[U[j]] = D[j]
+                U[D[j]] = U[j]
+                S[C[j]] -= 1
+                j = R[j]
+            i = D[i]
+
+    def uncover(self, c):
+        L, R, U, D, C, S = self.L, self.R, self.U, self.D, self.C, self.S
+        i = U[c]
+        while i != c:
+            j = L[i]
+            while j != i:
+                S[C[j]] += 1
+                D[U[j]] = j
+                U[D[j]] = j
+                j = L[j]
+            i = U[i]
+        R[L[c]] = c
+        L[R[c]] = c
+
+    def select(self, r):
+        "Cover every column of the row holding node r."
+        self.cover(self.C[r])
+        self.select_row(r)
+
+    def unselect(self, r):
+        "Undo select(r)."
+        self.unselect_row(r)
+        self.uncover(self.C[r])
+
+    def solve(self, givens, budget, stats):
+        """Return the matrix rows of a solution (givens included), or None if
+        there is none. The matrix is left as it was found, even when the
+        budget raises BudgetExceeded. Search counters go to stats."""
+        size, first, R, C = self.size, self.first, self.R, self.C
+        with self.lock:
+            chosen = []
+            try:
+                for cell, d in enumerate(givens):
+                    if d:
+                        node = first + 4 * (size * cell + d - 1)
+                        # Equal givens in one unit share a column; it is
+                        # already covered when the second one is selected.
+                        j = node
+                        while True:
+                            if R[self.L[C[j]]] != C[j]:
+                                return None
+                            j = R[j]
+                            if j == node:
+                                break
+                        self.select(node)
+                        chosen.append(node)
+
+                rows = [(node - first) // 4 for node in chosen]
+                return rows if self.search(rows, budget, stats) else None
+            finally:
+                for node in reversed(chosen):
+                    self.unselect(node)
+
+    def search(self, rows, budget, stats):
+        """Algorithm X without recursion: the stack holds the column covered
+        and the row tried at each level, so an empty 36x36 board (1296 levels)
+        does not hit the recursion limit. The rows of a solution are left in
+        rows, and the matrix is restored whatever happens."""
+        R, D, S, first = self.R, self.D, self.S, self.first
+        columns, tried = [], []
+        try:
+            while R[0] != 0:
+                depth = len(columns)
+                budget.node()
+                if depth > stats.max_depth:
+                    stats.max_depth = depth
+                if stats.on_node is not None:
+                    stats.on_node(self, depth)
+
+                # Branch on the column with the fewest rows left.
+                c = best = R[0]
+                n = S[c]
+                while c != 0 and n > 1:
+                    if S[c] < n:
+                        best, n = c, S[c]
+                    c = R[c]
+
+                if n:
+                    self.cover(best)
+                    r = D[best]
+                    columns.append(best)
+                    tried.append(r)
+                else:
+                    # Backtrack to the deepest level with a row left to try.
+                    while True:
+                        if not columns:
+                            return False
+                        best, r = columns[-1], tried[-1]
+                        self.unselect_row(r)
+                        rows.pop()
+                        stats.backtracks += 1
+                        r = D[r]
+                        if r != best:
+                            tried[-1] = r
+                            break
+                        columns.pop()
+                        tried.pop()
+                        self.uncover(best)
+                self.select_row(r)
+                rows.append((r - first) // 4)
+            return True  # Every column is covered
+        finally:
+            while columns:
+                self.unselect_row(tried.pop())
+                self.uncover(columns.pop())
+
+    def select_row(self, r):
+        "Cover the other columns of the row of node r (its own is covered)."
+        j = self.R[r]
+        while j != r:
+            self.cover(self.C[j])
+            j = self.R[j]
+
+    def unselect_row(self, r):
+        j = self.L[r]
+        while j != r:
+            self.uncover(self.C[j])
+            j = self.L[j]
+
+
+_MATRICES = {}
+
+
+def exact_cover(size):
+    "Return this process's ExactCover matrix for the given size."
+    try:
+        return _MATRICES[size]
+    except KeyError:
+        m = _MATRICES[size] = ExactCover(size)
+        return m
@@ -0,0 +1,196 @@
+'''
+Static part of the Sudoku CNF encoding, built once per size with NumPy.
+
+Variable size * cell + d (1 <= d <= size) is true when the cell holds digit d.
+Only the givens depend on the puzzle; every other clause is the same for all
+puzzles of a size, so it is generated once, deduplicated and cached here.
+
+Every cell holds at least one digit, and every digit appears at most once in
+every row, column and box. (Together these already force exactly one digit
+per cell, so no separate cell constraint is needed.) The at-most-one part
+can be encoded in several ways:
+
+    pairwise    one binary clause per pair of peers and digit; O(n^4)
+                clauses, no auxiliary variables.
+    sequential  Sinz's sequential counter: n - 1 auxiliary variables and
+                3n - 4 clauses per unit and digit.
+    commander   Klieber and Kwon: the unit is split into box-sized groups,
+                each with a commander variable; pairwise inside a group and
+                between commanders.
+    product     Chen's two-dimensional product: the unit is laid out on a
+                box x box grid with one variable per row and per column of it.
+
+Auxiliary variables are numbered after the size**3 cell variables (see
+`primary`), in blocks of consecutive ids per unit and digit. Decoders only
+look at variables 1..primary.
+'''
+
+import threading
+
+import numpy as np
+from topology import topology
+
+ENCODINGS = ('pairwise', 'sequential', 'commander', 'product')
+
+
+def at_most_one_pairwise(groups):
+    "Binary clauses forbidding any two literals of a row of `groups`."
+    a, b = np.triu_indices(groups.shape[1], 1)
+    return -np.stack([groups[:, a], groups[:, b]], axis=2).reshape(-1, 2)
+
+
+class CNFTemplate:
+    def __init__(self, size, encoding='pairwise'):
+        assert encoding in ENCODINGS, 'unknown encoding ' + repr(encoding)
+        topo = topology(size)
+        digits = np.arange(1, size + 1, dtype=np.int32)
+        cells = np.arange(topo.cells, dtype=np.int32)
+
+        self.size = size
+        self.encoding = encoding
+        self.primary = self.nvars = size ** 3
+
+        # Every cell holds at least one value.
+        self.domains = cells[:, None] * size + digits[None, :]
+
+        # No two cells of a unit hold the same value.
+        units = np.array(topo.units, dtype=np.int32)
+        if encoding == 'pairwise':
+            self.amo = self.encode_pairwise(topo, units, digits)
+        else:
+            # One group of size literals per unit and digit, (3 * size, size).
+            groups = (units[:, None, :] * size + digits[None, :, None])
+            groups = groups.reshape(-1, size)
+            self.amo = getattr(self, 'encode_' + encoding)(groups)
+        self.amo = self.amo.astype(np.int32)
+
+        self.blocks = (self.domains, self.amo)
+        self.nclauses = sum(len(block) for block in self.blocks)
+        self._clauses = None
+        self._dimacs = None
+        self._buffers = threading.local()
+        self._flat = None
+
+    def auxiliary(self, groups, k):
+        "Allocate k fresh variables per group, as a (groups, k) array."
+        first = self.nvars + 1
+        self.nvars += groups * k
+        return np.arange(first, self.nvars + 1, dtype=np.int32).reshape(groups, k)
+
+    def encode_pairwise(self, topo, units, digits):
+        # Each pair of peers is emitted once, even when the two cells share
+        # a row and a box.
+        size = self.size
+        a, b = np.triu_indices(size, 1)
+        pairs = np.stack([units[:, a].ravel(), units[:, b].ravel()], axis=1)
+        pairs = np.unique(pairs[:, 0] * topo.cells + pairs[:, 1])
+        pairs = np.stack([pairs // topo.cells, pairs % topo.cells], axis=1)
+
+        lits = pairs[:, :, None] * size + digits[None, None, :]
+        return -lits.transpose(0, 2, 1).reshape(-1, 2)
+
+    def encode_sequential(self, x):
+        # s_i is true when one of x_1..x_i is: x_i -> s_i, s_(i-1) -> s_i and
+        # s_(i-1) -> not x_i.
+        s = self.auxiliary(len(x), x.shape[1] - 1)
+        return np.concatenate([
+            np.stack([-x[:, :-1], s], axis=2).reshape(-1, 2),
+            np.stack([-s[:, :-1], s[:, 1:]], axis=2).reshape(-1, 2),
+            np.stack([-x[:, 1:], -s], axis=2).reshape(-1, 2)])
+
+    def encode_commander(self, x):
+        # Group j of box literals has commander c_j: at most one literal of a
+        # group, any of them implies c_j, and at most one commander.
+        box = topology(self.size).box
+        c = self.auxiliary(len(x), box)
+        inner = x.reshape(-1, box)
+        return np.concatenate([
+            at_most_one_pairwise(inner),
+            np.stack([-inner, np.repeat(c.reshape(-1, 1), box, axis=1)],
+                     axis=2).reshape(-1, 2),
+            at_most_one_pairwise(c)])
+
+    def encode_product(self, x):
+        # Literal k sits at (k // box, k % box); it implies u of its row and
+        # v of its column, and at most one u and one v may be true.
+        box = topology(self.size).box
+        uv = self.auxiliary(len(x), 2 * box)
+        u, v = uv[:, :box], uv[:, box:]
+        k = np.arange(self.size)
+        return np.concatenate([
+            np.stack([-x, u[:, k // box]], axis=2).reshape(-1, 2),
+            np.stack([-x, v[:, k % box]], axis=2).reshape(-1, 2),
+            at_most_one_pairwise(u),
+            at_most_one_pairwise(v)])
+
+    def clauses(self):
+        "The static clauses as lists of Python ints (what pycosat expects)."
+        if self._clauses is None:
+            self._clauses = [c for block in self.blocks for c in block.tolist()]
+        return self._clauses
+
+    def flat(self):
+        """The static clauses as one zero-terminated int32 array, DIMACS style,
+        and the offset at which each clause starts."""
+        if self._flat is None:
+            flat = np.concatenate([
+                np.hstack([block, np.zeros((len(block), 1), np.int32)]).ravel()
+                for block in self.blocks])
+            starts = np.concatenate([[0], np.flatnonzero(flat == 0)[:-1] + 1])
+            self._flat = (flat, starts)
+        return self._flat
+
+    def dimacs(self):
+        "The static clauses as DIMACS lines, without the 'p cnf' header."
+        if self._dimacs is None:
+            self._dimacs = ''.join(' '.join(map(str, row)) + ' 0\n'
+                                   for row in self.clauses())
+        return self._dimacs
+
+    def dimacs_input(self, cnf):
+        """The complete DIMACS text of the static clauses plus the clauses in
+        cnf (the givens), as bytes for a SAT solver's stdin. Each thread keeps
+        a preallocated buffer: room for the header and one unit clause per
+        cell, then the static clauses. The puzzle's lines are written into
+        that room, just before the static part, and a memoryview from there to
+        the end is returned, so the static part is never copied again. Longer
+        cnf (blocking clauses) falls back to concatenation."""
+        prefix = 'p cnf {} {}\n{}'.format(
+            self.nvars, self.nclauses + len(cnf),
+            ''.join(' '.join(map(str, row)) + ' 0\n' for row in cnf)).encode('ascii')
+        try:
+            buf, room = self._buffers.buf, self._buffers.room
+        except AttributeError:
+            room = 48 + self.size ** 2 * (len(str(self.primary)) + 3)
+            buf = bytearray(room) + self.dimacs().encode('ascii')
+            self._buffers.buf, self._buffers.room = buf, room
+
+        if len(prefix) > room:
+            return prefix + buf[room:]
+        buf[room - len(prefix):room] = prefix
+        return memoryview(buf)[room - len(prefix):]
+
+
+_TEMPLATES = {}
+
+
+def cnf_template(size, encoding='pairwise'):
+    "Return the memoized CNFTemplate for boards of the given size."
+    try:
+        return _TEMPLATES[size, encoding]
+    except KeyError:
+        t = _TEMPLATES[size, encoding] = CNFTemplate(size, encoding)
+        return t
+
+
+def counts(sizes=(9, 16, 25, 36)):
+    "Print the variable and clause counts of every encoding."
+    print('{:>5} {:>11} {:>9} {:>10}'.format('size', 'encoding', 'vars', 'clauses'))
+    for size in sizes:
+        for encoding in ENCODINGS:
+            t = CNFTemplate(size, encoding)
+            print('{:>5} {:>11} {:>9} {:>10}'.format(size, encoding, t.nvars, t.nclauses))
+
+
+if __name__ == '__main__':
+    counts()
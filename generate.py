@@ -0,0 +1,199 @@
+'''
+Puzzle generator.
+
+Puzzles are made a block at a time with NumPy:
+
+1. Full grids. A few random seed grids are solved with ProSolver from random
+   diagonal boxes. Every puzzle then gets a random symmetry of one of them
+   (digit relabeling, band/stack and row/column permutations, transposition).
+2. Clue removal. Each puzzle gets a random removal order. Removing clues only
+   ever weakens naked and hidden singles, so the longest prefix of the order
+   that still leaves the puzzle solvable by singles alone is found by binary
+   search, propagating the whole block at each step (see batch.py). A puzzle
+   that singles solve has exactly one solution.
+3. Difficulty bands. 'easy' puzzles stop at that prefix, keeping at least
+   EASY_CLUES of the cells. 'medium' ones keep the clue that ended the prefix
+   and search again past it, for ROUNDS rounds. 'hard' ones then remove the
+   remaining clues one at a time while count_solutions() still finds exactly
+   one solution, and are kept only if singles no longer solve them.
+'''
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from batch import SYMBOLS, propagator
+from stream import write_solutions
+from sudoku import HEX_REP, Grid, ProSolver, count_solutions, digit_table, solve_puzzle
+from topology import topology
+
+BANDS = ('easy', 'medium', 'hard')
+
+# Share of the cells an easy puzzle keeps as clues.
+EASY_CLUES = 0.45
+
+# Rounds of clue removal for medium (and, before the uniqueness checks, hard)
+# puzzles.
+ROUNDS = 4
+
+# Puzzles made per block, and per random seed grid within a block.
+BLOCK = 2048
+SEED_SHARE = 64
+
+
+def seed_grids(count, size, rng):
+    "Solve count random grids; an (count, cells) array of digits."
+    t = topology(size)
+    grids = []
+    while len(grids) < count:
+        givens = bytearray(t.cells)
+        for b in range(t.box):
+            box = t.units[2 * size + b * t.box + b]  # Diagonal boxes are independent
+            for c, d in zip(box, rng.permutation(size) + 1):
+                givens[c] = d
+        solution = solve_puzzle(''.join(HEX_REP[d] if d else '.' for d in givens),
+                                ProSolver, size)
+        if solution:
+            grids.append(bytearray(solution.encode('ascii').translate(digit_table(size))))
+    return np.array(grids, dtype=np.uint8)
+
+
+def permutations(count, box, rng):
+    "count random row (or column) orders that keep bands (stacks) together."
+    bands = np.argsort(rng.random((count, box)), axis=1)
+    inside = np.argsort(rng.random((count, box, box)), axis=2)
+    return (bands[:, :, None] * box + inside).reshape(count, box * box)
+
+
+def full_grids(count, size, rng):
+    "count random solved grids, as random symmetries of a few seed grids."
+    box = topology(size).box
+    seeds = seed_grids(max(1, count // SEED_SHARE), size, rng).reshape(-1, size, size)
+    rows = permutations(count, box, rng)
+    cols = permutations(count, box, rng)
+    which = rng.integers(len(seeds), size=count)
+    grids = seeds[which[:, None, None], rows[:, :, None], cols[:, None, :]]
+
+    flip = rng.random(count) < 0.5
+    grids[flip] = grids[flip].transpose(0, 2, 1)
+
+    labels = np.zeros((count, size + 1), dtype=np.uint8)
+    labels[:, 1:] = np.argsort(rng.random((count, size)), axis=1) + 1
+    return np.take_along_axis(labels, grids.reshape(count, -1).astype(np.intp), axis=1)
+
+
+def singles_prefix(grids, rank):
+    """For each grid, the largest k such that removing the cells of rank < k
+    leaves a puzzle naked and hidden singles solve."""
+    count, cells = grids.shape
+    p = propagator(int(round(cells ** 0.5)))
+    lo = np.zeros(count, dtype=np.intp)            # Always solvable
+    hi = np.full(count, cells + 1, dtype=np.intp)  # Never solvable
+    active = np.arange(count)
+    while len(active):
+        mid = (lo[active] + hi[active]) // 2
+        digits = np.where(rank[active] < mid[:, None], 0, grids[active])
+        cand = p.candidates_of(digits)
+        ok = p.propagate(cand) & (cand.sum(axis=(1, 2)) == cells)
+        lo[active] = np.where(ok, mid, lo[active])
+        hi[active] = np.where(ok, hi[active], mid)
+        active = active[hi[active] - lo[active] > 1]
+    return lo
+
+
+def thin(grids, rank, rounds):
+    """Remove clues in rank order while singles still solve the puzzle. The
+    clue that stops a round is kept and the next round carries on past it.
+    Return the digits left."""
+    rank = rank.copy()
+    cells = grids.shape[1]
+    for _ in range(rounds):
+        k = singles_prefix(grids, rank)[:, None]
+        rank[rank < k] = -1             # Removed for good
+        rank[rank == k] = cells + 1     # Kept for good
+    return np.where(rank < 0, 0, grids).astype(np.uint8)
+
+
+def harden(digits, order, size):
+    """Keep removing clues, in order, while the puzzle stays unique. Return
+    the puzzle string, or None if singles still solve it."""
+    puzzle = [HEX_REP[d] if d else '.' for d in digits.tolist()]
+    for c in order:
+        if puzzle[c] != '.':
+            d, puzzle[c] = puzzle[c], '.'
+            if count_solutions(''.join(puzzle), 2, size=size) != 1:
+                puzzle[c] = d
+
+    problem = ''.join(puzzle)
+    values = ProSolver(Grid(problem, size), size, '').initial_assignment()
+    if all(not m & (m - 1) for m in values):
+        return None
+    return problem
+
+
+def make_block(count, size, band, seed):
+    "Up to count puzzles of the band (hard puzzles can come up short)."
+    rng = np.random.default_rng(seed)
+    cells = size * size
+    grids = full_grids(count, size, rng)
+    rank = np.argsort(rng.random((count, cells)), axis=1)  # Removal order of each cell
+
+    if band == 'easy':
+        keep = np.minimum(singles_prefix(grids, rank), cells - int(np.ceil(EASY_CLUES * cells)))
+        digits = np.where(rank < keep[:, None], 0, grids).astype(np.uint8)
+    else:
+        digits = thin(grids, rank, ROUNDS)
+
+    if band != 'hard':
+        return [row.tobytes().decode('ascii') for row in SYMBOLS[digits]]
+
+    order = np.argsort(rank, axis=1).tolist()
+    puzzles = (harden(d, o, size) for d, o in zip(digits, order))
+    return [p for p in puzzles if p]
+
+
+def generate(count, size=9, band='easy', workers=None, seed=None, block=BLOCK):
+    """Yield count puzzle strings of the given size and band, each with exactly
+    one solution. Blocks of up to `block` puzzles are made by `workers`
+    processes (0 makes them in this process), and only as many as are still
+    needed are in flight. Without a seed, puzzles come out as their block
+    finishes. With a seed, blocks come out in the order they were started, so
+    the same puzzles come out every time, whatever the number of workers."""
+    assert band in BANDS, 'unknown band ' + repr(band)
+    seeds = np.random.SeedSequence(seed)
+    block = min(block, count)
+    if band == 'hard':
+        block = min(block, 64)  # Hard puzzles are checked one by one
+
+    if workers == 0:
+        while count > 0:
+            for p in make_block(block, size, band, seeds.spawn(1)[0])[:count]:
+                yield p
+                count -= 1
+        return
+
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(workers)
+    try:
+        pending = []  # In submission order
+        while count > 0:
+            while len(pending) < 2 * workers and len(pending) * block < count:
+                pending.append(pool.submit(make_block, block, size, band,
+                                           seeds.spawn(1)[0]))
+            if seed is None:
+                future = next(iter(wait(pending, return_when=FIRST_COMPLETED)[0]))
+            else:
+                future = pending[0]
+            pending.remove(future)
+            for p in future.result()[:count]:
+                yield p
+                count -= 1
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def generate_file(path, count, size=9, band='easy', workers=None, seed=None):
+    """Write count generated puzzles to path, one per line in the format
+    stream.read_puzzles reads ('.gz' compresses). Return the number written."""
+    return write_solutions(path, generate(count, size, band, workers, seed))
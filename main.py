@@ -1,23 +1,188 @@
-from sudoku import *
-from benchmark import Benchmark
+'''
+Command-line entry point: solve puzzles, run the benchmarks, generate
+puzzles or run sharded bulk solves.
 
-''' Use Sudoku().solve_all() to solve all problems using a specific solver'''
-# Sudoku(9).solve_all(NaiveSolver)  # You wouldn't want to do this!!
-# Sudoku(9).solve_all(NaiveSolver)  # It would take FOREVER
+    python main.py solve --solver dlx 4.....8.5.3..........7......2.....6.....
+    python main.py solve --solver sat --size 16 --difficulty hard
+    python main.py solve --input puzzles.txt.gz --output solutions.txt --workers 4
+    python main.py bench --size 9 --difficulty hard --solvers pro,dlx,sat --plot
+    python main.py generate 1000 --band medium --output puzzles.txt.gz
+    python main.py shards run puzzles.txt.gz runs/big --workers 4 --output solutions.txt
 
-# Sudoku(9).solve_all(ProSolver)
-# Sudoku(16).solve_all(ProSolver)
+Nothing heavy is imported up front. A solver's module and its backend
+(pycosat, NumPy, the native library, the portfolio's process pool) load when
+that solver first runs, and the benchmark, matplotlib, the generator and
+shards.py only for their commands. Solving one puzzle starts in a few tens of
+milliseconds.
 
-Sudoku(9).solve_all(SATSolver)
-Sudoku(16).solve_all(SATSolver)
+From Python, the same things are:
 
-''' Use Sudoku().solve([solver], [problem], [filename]) to solve one problem.'''
-# Sudoku(9).solve(NaiveSolver, Sudoku(9).easy[1], 'test')
-# Sudoku(9).solve(ProSolver, Sudoku(9).easy[1], 'test')
-# Sudoku(9).solve(SATSolver, Sudoku(9).easy[1], 'test')
+    Sudoku(9).solve_all(ProSolver)                             # The built-in puzzles
+    Sudoku(9).solve(DLXSolver, Sudoku(9).hard[0], 'test.cnf')  # One puzzle
+    Sudoku(9).solve(partial(SATSolver, backend='picosat'), Sudoku(9).easy[1], 'test.cnf')
+    SATSolver(Grid(Sudoku(9).easy[1], 9), 9, 'test.cnf').save_cnf()  # Keep cnf/test.cnf
+    count_solutions(Sudoku(9).hard[0]) == 1                    # Unique?
+    Sudoku(9).solve_all(partial(CachingSolver, solver=DLXSolver))
+    Sudoku(9).solve(PortfolioSolver, Sudoku(9).hard[0], 'test.cnf')
+    Benchmark().plot('easy', 16)                               # Needs matplotlib
+'''
 
-''' Use Benchamrk().plot_all() to see all the graphs.'''
-# Benchmark().plot_all()
+from __future__ import print_function
+import argparse
+import importlib
+import sys
+from functools import partial
 
-''' Use Benchamrk().plot([dificulty], [size]) to see specific graph.'''
-Benchmark().plot('easy', 16)
+# Solver name -> (module, class, keyword arguments). The module is imported
+# when the solver is picked.
+SOLVERS = {
+    'naive': ('sudoku', 'NaiveSolver', {}),
+    'pro': ('sudoku', 'ProSolver', {}),
+    'pro-intersections': ('sudoku', 'ProSolver', {'inference': 'intersections'}),
+    'pro-pairs': ('sudoku', 'ProSolver', {'inference': 'pairs'}),
+    'dlx': ('sudoku', 'DLXSolver', {}),
+    'sat': ('sudoku', 'SATSolver', {}),
+    'sat-native': ('sudoku', 'SATSolver', {'backend': 'native'}),
+    'sat-picosat': ('sudoku', 'SATSolver', {'backend': 'picosat'}),
+    'cached': ('sudoku', 'CachingSolver', {}),
+    'portfolio': ('portfolio', 'PortfolioSolver', {}),
+}
+
+DEFAULT_SOLVER = 'dlx'
+
+# Board sizes the solvers take, and those with built-in puzzles.
+SIZES = (9, 16, 25, 36)
+BUILTIN_SIZES = (9, 16)
+
+
+def load_solver(name, timeout=None):
+    """The solver class of a name in SOLVERS, with its options bound (and a
+    Budget of timeout seconds, restarted by every solve)."""
+    module, cls, options = SOLVERS[name]
+    solver = getattr(importlib.import_module(module), cls)
+    if timeout is not None:
+        from budget import Budget
+        options = dict(options, budget=Budget(timeout))
+    return partial(solver, **options) if options else solver
+
+
+def puzzle_error(puzzle):
+    "Why a one-line puzzle cannot be solved, or None if it looks fine."
+    from sudoku import SYMBOLS, puzzle_size
+
+    size = puzzle_size(puzzle)
+    if size not in SIZES or len(puzzle) != size * size:
+        return '{} cells; a puzzle has {}'.format(
+            len(puzzle), ', '.join(str(n * n) for n in SIZES))
+    symbols = SYMBOLS[:size]
+    if not set(puzzle) <= set('.0' + symbols + symbols.lower()):
+        return 'characters other than . and ' + symbols
+    return None
+
+
+def solve(args):
+    solver = load_solver(args.solver, args.timeout)
+    if args.input:
+        from stream import read_puzzles, solve_file
+        if args.output:
+            solve_file(args.input, args.output, solver, args.workers)
+        else:
+            from sudoku import solve_puzzle
+            for p in read_puzzles(args.input):
+                print(solve_puzzle(p, solver) or '')
+        return 0
+
+    from budget import SOLVED
+    from sudoku import Sudoku, puzzle_size, solve_puzzle
+    if not args.puzzles:
+        Sudoku(args.size).solve_all(solver, args.difficulty)
+        return 0
+
+    unsolved = 0
+    for i, p in enumerate(args.puzzles):
+        if args.quiet:
+            solution = solve_puzzle(p, solver)
+            unsolved += solution is None
+            print(solution or '')
+        else:
+            s = Sudoku(puzzle_size(p))
+            s.solve(solver, p, 'puzzle{}.cnf'.format(i))
+            unsolved += s.status != SOLVED
+    return 1 if unsolved else 0
+
+
+def bench(rest):
+    from benchmark import main
+    return main(rest)
+
+
+def shards(rest):
+    from shards import main
+    return main(rest)
+
+
+def generate(args):
+    from generate import generate, generate_file
+    if args.output:
+        generate_file(args.output, args.count, args.size, args.band, args.workers,
+                      args.seed)
+    else:
+        for p in generate(args.count, args.size, args.band, args.workers, args.seed):
+            print(p)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    p = commands.add_parser('solve', help='solve puzzles and show the solutions')
+    p.add_argument('puzzles', nargs='*', metavar='puzzle',
+                   help="one-line puzzles, '.' for an empty cell (default: the "
+                        "built-in puzzles of --size)")
+    p.add_argument('--solver', default=DEFAULT_SOLVER, choices=sorted(SOLVERS))
+    p.add_argument('--size', type=int, default=9, choices=BUILTIN_SIZES,
+                   help='size of the built-in puzzles')
+    p.add_argument('--difficulty', default='all', choices=('easy', 'hard', 'all'),
+                   help='which built-in puzzles')
+    p.add_argument('--input', help='solve every puzzle of this file (.gz too)')
+    p.add_argument('--output', help='write the solutions of --input here, in order')
+    p.add_argument('--workers', type=int,
+                   help='worker processes with --output (0 solves here; default: CPUs)')
+    p.add_argument('--timeout', type=float, help='seconds per puzzle')
+    p.add_argument('-q', '--quiet', action='store_true',
+                   help='print only one solution line per puzzle')
+
+    commands.add_parser('bench', add_help=False,
+                        help='run benchmark.py (see python benchmark.py --help)')
+
+    commands.add_parser('shards', add_help=False,
+                        help='run shards.py (see python shards.py --help)')
+
+    p = commands.add_parser('generate', help='generate puzzles with one solution each')
+    p.add_argument('count', type=int)
+    p.add_argument('--size', type=int, default=9)
+    p.add_argument('--band', default='easy', choices=('easy', 'medium', 'hard'))
+    p.add_argument('--output', help='write them to this file (.gz compresses)')
+    p.add_argument('--workers', type=int,
+                   help='worker processes (0 generates here; default: CPUs)')
+    p.add_argument('--seed', type=int)
+
+    args, rest = parser.parse_known_args(argv)
+    if args.command == 'bench':
+        return bench(rest)
+    if args.command == 'shards':
+        return shards(rest)
+    if rest:
+        parser.error('unrecognized arguments: ' + ' '.join(rest))
+    if args.command == 'solve':
+        for p in args.puzzles:
+            error = puzzle_error(p)
+            if error:
+                parser.error('bad puzzle {!r}: {}'.format(p, error))
+    return solve(args) if args.command == 'solve' else generate(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+'''
+ctypes binding to the PicoSAT sources bundled in picosat/.
+
+The static Sudoku CNF of a size is loaded once into a long-lived solver and
+every puzzle is then solved by passing its givens as assumptions, so learned
+clauses carry over between puzzles and nothing is re-encoded, written or parsed.
+'''
+
+import ctypes
+import os
+import threading
+from subprocess import check_call
+from budget import Budget
+from encoding import cnf_template
+
+
+SOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'picosat')
+LIBRARY = os.path.join(SOURCES, 'libpicosat.so')
+
+SATISFIABLE = 10
+UNSATISFIABLE = 20
+UNKNOWN = 0
+
+NO_LIMIT = (1 << 64) - 1
+
+INTERRUPT = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p)
+
+_lib = None
+_load_lock = threading.Lock()
+
+
+def build(cc=None):
+    """Compile picosat.c into a shared library next to the sources. The
+    compiler writes a temporary file of this process, renamed into place
+    when complete, so processes building at the same time never load a
+    partly written library."""
+    cc = cc or os.environ.get('CC', 'cc')
+    tmp = '{}.{}.tmp'.format(LIBRARY, os.getpid())
+    try:
+        check_call([cc, '-O3', '-DNDEBUG', '-fPIC', '-shared',
+                    '-o', tmp, 'picosat.c', 'version.c'], cwd=SOURCES)
+        os.replace(tmp, LIBRARY)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def load():
+    "Return the loaded library, building it first if needed."
+    global _lib
+    with _load_lock:
+        if _lib is None:
+            _lib = _load()
+    return _lib
+
+
+def _load():
+    if not os.path.exists(LIBRARY):
+        build()
+    lib = ctypes.CDLL(LIBRARY)
+    lib.picosat_init.restype = ctypes.c_void_p
+    lib.picosat_init.argtypes = []
+    lib.picosat_reset.argtypes = [ctypes.c_void_p]
+    lib.picosat_adjust.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lib.picosat_add.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lib.picosat_add_lits.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+    lib.picosat_push.argtypes = [ctypes.c_void_p]
+    lib.picosat_pop.argtypes = [ctypes.c_void_p]
+    lib.picosat_assume.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lib.picosat_sat.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lib.picosat_deref.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    lib.picosat_propagations.restype = ctypes.c_ulonglong
+    lib.picosat_propagations.argtypes = [ctypes.c_void_p]
+    lib.picosat_set_propagation_limit.argtypes = [ctypes.c_void_p,
+                                                  ctypes.c_ulonglong]
+    lib.picosat_set_interrupt.argtypes = [ctypes.c_void_p, ctypes.c_void_p,
+                                          INTERRUPT]
+    return lib
+
+
+class IncrementalSolver:
+    """One PicoSAT instance holding the static CNF of a size. A PicoSAT
+    instance is not reentrant, so calls to solve() are serialized."""
+
+    def __init__(self, size, encoding='pairwise'):
+        self.lib = load()
+        self.size = size
+        self.template = cnf_template(size, encoding)
+        self.lock = threading.Lock()
+
+        self.ptr = self.lib.picosat_init()
+        self.budget = Budget()
+        # PicoSAT polls this between decisions; keep a reference so the
+        # callback outlives this constructor.
+        self.interrupt = INTERRUPT(lambda state: self.budget.expired())
+        self.lib.picosat_set_interrupt(self.ptr, None, self.interrupt)
+        self.lib.picosat_adjust(self.ptr, self.template.nvars)
+        flat, starts = self.template.flat()
+        base = flat.ctypes.data
+        for start in starts.tolist():
+            self.lib.picosat_add_lits(self.ptr, base + 4 * start)
+
+    def solve(self, givens, budget=None):
+        """Solve under the given unit literals. Return the true variable of
+        every cell, in cell order, or None if the puzzle has no solution.
+        Auxiliary variables of the encoding are not read back.
+        Raise BudgetExceeded when the budget stops the solver first."""
+        with self.lock:
+            self.budget = budget = budget or Budget()
+            return self.sat(givens, budget)
+
+    def count(self, givens, limit=2, budget=None):
+        """Find up to limit solutions under the given unit literals and return
+        them (as solve() does). Each solution found is blocked by a clause
+        added in a PicoSAT context, which is popped again afterwards, so the
+        long-lived clause database and what it learned are kept."""
+        lib, ptr = self.lib, self.ptr
+        with self.lock:
+            self.budget = budget = budget or Budget()
+            solutions = []
+            lib.picosat_push(ptr)
+            try:
+                while len(solutions) < limit:
+                    model = self.sat(givens, budget)
+                    if model is None:
+                        break
+                    solutions.append(model)
+                    for var in model:
+                        lib.picosat_add(ptr, -var)
+                    lib.picosat_add(ptr, 0)
+            finally:
+                lib.picosat_pop(ptr)
+            return solutions
+
+    def sat(self, givens, budget):
+        lib, ptr, size = self.lib, self.ptr, self.size
+        start = lib.picosat_propagations(ptr)
+        if budget.max_propagations is not None:
+            lib.picosat_set_propagation_limit(
+                ptr, start + max(0, budget.max_propagations - budget.propagations))
+
+        budget.check()
+        for lit in givens:
+            lib.picosat_assume(ptr, lit)
+        try:
+            result = lib.picosat_sat(ptr, -1)
+        finally:
+            lib.picosat_set_propagation_limit(ptr, NO_LIMIT)
+            budget.propagations += lib.picosat_propagations(ptr) - start
+
+        if result == UNKNOWN:
+            budget.check()
+            budget.stop('propagations')
+        elif result != SATISFIABLE:
+            return None
+
+        model = []
+        deref = lib.picosat_deref
+        for v in range(1, self.template.primary + 1, size):
+            for var in range(v, v + size):
+                if deref(ptr, var) > 0:
+                    model.append(var)
+                    break
+        return model
+
+    def close(self):
+        if self.ptr:
+            self.lib.picosat_reset(self.ptr)
+            self.ptr = None
+
+
+_SOLVERS = {}
+
+
+def incremental_solver(size, encoding='pairwise'):
+    """Return this process's long-lived IncrementalSolver for the given size
+    and encoding."""
+    try:
+        return _SOLVERS[size, encoding]
+    except KeyError:
+        s = _SOLVERS[size, encoding] = IncrementalSolver(size, encoding)
+        return s
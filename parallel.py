@@ -0,0 +1,95 @@
+'''
+Parallel batch solving over a pool of worker processes.
+
+Puzzles are sent to the workers in chunks. Solved grids come back through a
+shared-memory byte array (one byte per cell, holding the digit), so only the
+chunk position and a solved flag per puzzle are pickled on the way back.
+'''
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import chain, islice
+from multiprocessing.sharedctypes import RawArray
+
+import decorators
+from sudoku import HEX_REP, Grid, ProSolver, puzzle_size
+from topology import topology
+
+# Turns a buffer of digits into the one-line solution format.
+DIGITS = bytes(bytearray(ord(HEX_REP.get(d, '.')) for d in range(256)))
+
+_worker = {}
+
+
+def _init_worker(out, size, solver):
+    decorators.verbose = False
+    _worker.update(out=memoryview(out).cast('B'), size=size, solver=solver)
+
+
+def _solve_chunk(slot, index, puzzles):
+    out, size, solver = _worker['out'], _worker['size'], _worker['solver']
+    cells = size * size
+    spots = topology(size).spots
+    solved = bytearray(len(puzzles))
+    for k, p in enumerate(puzzles):
+        s = solver(Grid(p, size), size, 'batch_{}.cnf'.format(index + k))
+        _, ok = s.solve()
+        if ok:
+            start = (slot + k) * cells
+            out[start:start + cells] = bytes(bytearray(s.sigma[spot] for spot in spots))
+            solved[k] = 1
+    return slot, bytes(solved)
+
+
+def solve_many(puzzles, solver=ProSolver, size=None, workers=None,
+               chunksize=64, ordered=False):
+    """Solve an iterable of puzzle strings over `workers` processes.
+
+    Yields (index, solution) pairs, where index is the puzzle's position in the
+    input and solution is a string in the same format as the puzzle, or None if
+    the solver found no solution. Results come out as soon as their chunk is
+    done unless ordered=True, which keeps input order. The input is consumed
+    lazily, a bounded window of chunks at a time, so it can be a generator."""
+    workers = workers or os.cpu_count() or 1
+    puzzles = iter(puzzles)
+    first = next(puzzles, None)
+    if first is None:
+        return
+
+    size = size or puzzle_size(first)
+    cells = size * size
+    window = workers * chunksize * 2  # Puzzles per window
+
+    # Two halves, so the next window is solved while this one is drained.
+    out = RawArray('B', 2 * window * cells)
+    view = memoryview(out).cast('B')
+    puzzles = chain([first], puzzles)
+
+    def submit(pool, half, index):
+        batch = list(islice(puzzles, window))
+        return [pool.submit(_solve_chunk, half * window + k, index + k,
+                            batch[k:k + chunksize])
+                for k in range(0, len(batch), chunksize)], len(batch)
+
+    pool = ProcessPoolExecutor(workers, initializer=_init_worker,
+                               initargs=(out, size, solver))
+    try:
+        index, half = 0, 0
+        current, n = submit(pool, half, index)
+        while current:
+            following, m = submit(pool, 1 - half, index + n)
+
+            done = current if ordered else as_completed(current)
+            for future in done:
+                slot, solved = future.result()
+                for k, ok in enumerate(bytearray(solved)):
+                    start = (slot + k) * cells
+                    solution = bytes(view[start:start + cells]).translate(DIGITS)
+                    yield (index + slot - half * window + k,
+                           solution.decode('ascii') if ok else None)
+
+            index, half = index + n, 1 - half
+            current, n = following, m
+    finally:
+        # Also reached when the caller stops iterating early.
+        pool.shutdown(wait=True, cancel_futures=True)
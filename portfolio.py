@@ -0,0 +1,261 @@
+'''
+Portfolio solving: race several engines on one puzzle and keep the first
+answer.
+
+The Python engines (ProSolver, DLXSolver, NaiveSolver) race in a long-lived
+pool of worker processes. The SAT engines race in threads of this process:
+the picosat backend spends its time in a subprocess, and the native one in
+C with the GIL released. Once one engine answers, the others are cancelled
+through their budgets. A worker process polls a shared flag, and a picosat
+subprocess is killed.
+
+Racing only pays off on hard puzzles. select() first looks at cheap features
+of the puzzle: its size, the number of givens, and the candidates left after
+naked and hidden single propagation. When the choice is obvious, a single
+engine runs in this process and nothing is raced.
+'''
+
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, \
+    ThreadPoolExecutor, wait
+from multiprocessing.sharedctypes import RawArray
+
+import decorators
+from budget import *
+from decorators import *
+from main import load_solver
+from stats import Stats
+from sudoku import HEX_REP, ProSolver, popcount
+
+# Engines (solver names from main.SOLVERS) raced in worker processes, and in
+# threads of this process.
+PROCESS_ENGINES = ('pro', 'dlx', 'naive')
+THREAD_ENGINES = ('sat', 'sat-native', 'sat-picosat')
+
+DEFAULT_ENGINES = ('pro', 'dlx', 'sat-picosat')
+
+# Below this many candidates per open cell after propagation, DLXSolver wins
+# so reliably (every 9x9 and 16x16 puzzle measured) that nothing is raced.
+RACE_BRANCHING = 3.7
+
+# Cancel flags shared with the worker processes, one per race in flight.
+# More races than this wait for a slot.
+SLOTS = 1024
+
+# Seconds to wait for cancelled thread engines (and their picosat process) to
+# stop before a race returns.
+STOP_WAIT = 0.2
+
+_pool = None
+_flags = None
+_threads = None
+_lock = threading.Lock()
+_slots = threading.Semaphore(SLOTS)
+_free = list(range(SLOTS))
+_worker = {}
+
+
+class RaceBudget(Budget):
+    "A Budget also cancelled when the race's flag is raised in shared memory."
+
+    def __init__(self, flags, slot, timeout=None, max_nodes=None, max_propagations=None):
+        self.flags = flags
+        self.slot = slot
+        Budget.__init__(self, timeout, max_nodes, max_propagations)
+
+    def check(self):
+        if self.flags[self.slot]:
+            self.cancelled = True
+        Budget.check(self)
+
+    def expired(self):
+        return bool(self.flags[self.slot]) or Budget.expired(self)
+
+
+def _init_worker(flags):
+    decorators.verbose = False
+    _worker['flags'] = flags
+
+
+def _run_process(engine, problem, size, slot, limits):
+    from sudoku import Grid
+    s = load_solver(engine)(Grid(problem, size), size, '',
+                            budget=RaceBudget(_worker['flags'], slot, *limits))
+    s.solve()
+    return s.status, s.sigma, s.stats
+
+
+def _run_thread(engine, grid, size, filename, budget):
+    s = load_solver(engine)(grid, size, filename, budget=budget)
+    with quiet():
+        s.solve()
+    return s.status, s.sigma, s.stats
+
+
+def executors():
+    """Return this process's worker pool, thread pool and cancel flags,
+    starting them on first use."""
+    global _pool, _flags, _threads
+    with _lock:
+        if _pool is None:
+            _flags = RawArray('B', SLOTS)
+            _pool = ProcessPoolExecutor(len(PROCESS_ENGINES), initializer=_init_worker,
+                                        initargs=(_flags,))
+            _threads = ThreadPoolExecutor(len(THREAD_ENGINES))
+        return _pool, _threads, _flags
+
+
+def acquire_slot():
+    "A free cancel flag slot; waits while SLOTS races are in flight."
+    _slots.acquire()
+    with _lock:
+        return _free.pop()
+
+
+def release_slot(slot, futures):
+    """Free a slot once the worker processes of its race, whose futures are
+    given, have all stopped; until then they still read its flag."""
+    running = set(futures)
+
+    def done(future):
+        with _lock:
+            running.discard(future)
+            if running:
+                return
+            _free.append(slot)
+        _slots.release()
+
+    if not futures:
+        done(None)
+    for future in futures:
+        future.add_done_callback(done)
+
+
+def features(grid):
+    """The cheap features select() decides on. Propagating the givens also
+    solves easy puzzles outright; the candidate bitmasks are kept in
+    'values' (False if propagation found a contradiction)."""
+    size, cells = grid.size, grid.topology.cells
+    values = ProSolver(grid, size, '').initial_assignment()
+    f = {'size': size, 'givens': cells - grid.givens.count(0), 'values': values}
+    if values:
+        f['open'] = sum(1 for m in values if m & (m - 1))
+        f['candidates'] = sum(popcount(m) for m in values)
+    else:
+        f['open'] = f['candidates'] = 0
+    return f
+
+
+def select(f, engines=DEFAULT_ENGINES):
+    """The engine of engines to run alone, 'propagation' when propagation
+    already decided the puzzle, or None to race."""
+    if not f['values'] or not f['open']:
+        return 'propagation'
+    branching = float(f['candidates'] - (f['size'] ** 2 - f['open'])) / f['open']
+    if branching < RACE_BRANCHING and 'dlx' in engines:
+        return 'dlx'
+    return None
+
+
+class PortfolioSolver:
+    """Races engines (names from PROCESS_ENGINES and THREAD_ENGINES) and takes
+    the first answer. With preselect (the default) obvious puzzles skip the
+    race, see select(). winner names the engine that answered, and stats are
+    the winner's. When every raced engine raised, status is ERROR and error
+    holds the first exception."""
+
+    def __init__(self, grid, size, filename, engines=DEFAULT_ENGINES, preselect=True,
+                 budget=None):
+        self.size = size
+        self.grid = grid
+        self.topology = grid.topology
+        self.filename = filename
+        self.engines = engines
+        self.preselect = preselect
+        self.budget = budget or Budget()
+        self.status = None
+        self.stats = Stats()
+        self.winner = None
+        self.error = None
+        self.sigma = {}
+
+    @time_deco
+    def solve(self):
+        self.budget.start()
+        choice = None
+        if self.preselect:
+            self.features = f = features(self.grid)
+            choice = select(f, self.engines)
+
+        if choice == 'propagation':
+            self.winner = choice
+            self.status = SOLVED if f['values'] else UNSOLVABLE
+            if f['values']:
+                for spot, m in zip(self.topology.spots, f['values']):
+                    self.sigma[spot] = m.bit_length()
+        elif choice is not None:
+            self.run(choice)
+        else:
+            self.race()
+        return self.status == SOLVED
+
+    def run(self, engine):
+        "Run one engine in this process and thread."
+        s = load_solver(engine)(self.grid, self.size, self.filename, budget=self.budget)
+        with quiet():
+            s.solve()
+        self.winner, self.status, self.sigma, self.stats = engine, s.status, s.sigma, s.stats
+
+    def race(self):
+        pool, threads, flags = executors()
+        slot = acquire_slot()
+        flags[slot] = 0
+        problem = ''.join(HEX_REP[d] if d else '.' for d in self.grid.givens)
+        # Every engine gets the whole time left and the caller's work limits.
+        limits = (self.budget.remaining(), self.budget.max_nodes,
+                  self.budget.max_propagations)
+
+        budgets, threaded, processes, pending, errors = [], [], [], {}, []
+        try:
+            for engine in self.engines:
+                if engine in PROCESS_ENGINES:
+                    future = pool.submit(_run_process, engine, problem, self.size,
+                                         slot, limits)
+                    processes.append(future)
+                else:
+                    budget = Budget(*limits)
+                    budgets.append(budget)
+                    future = threads.submit(_run_thread, engine, self.grid, self.size,
+                                            '{}.{}'.format(self.filename, engine), budget)
+                    threaded.append(future)
+                pending[future] = engine
+
+            self.status = TIMEOUT
+            while pending:
+                done, _ = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+                for future in done:
+                    engine = pending.pop(future)
+                    try:
+                        status, sigma, stats = future.result()
+                    except Exception as e:
+                        errors.append(e)
+                        continue  # A broken engine just loses
+                    if status == SOLVED or status == UNSOLVABLE:
+                        self.winner, self.status, self.sigma, self.stats = \
+                            engine, status, sigma, stats
+                        self.budget.nodes = stats.nodes  # Kept by stats.finish()
+                        return
+                if self.budget.expired():
+                    self.status = CANCELLED if self.budget.cancelled else TIMEOUT
+                    return
+            if len(errors) == len(self.engines):
+                self.status, self.error = ERROR, errors[0]
+        finally:
+            # Cancel the losers; they stop at their next budget check. The
+            # threads are waited for, so no picosat process outlives the race.
+            flags[slot] = 1
+            for budget in budgets:
+                budget.cancel()
+            if threaded:
+                wait(threaded, timeout=STOP_WAIT)
+            release_slot(slot, processes)
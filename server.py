@@ -0,0 +1,405 @@
+'''
+A long-running local solving service.
+
+Clients connect over a Unix socket (or localhost TCP) and send JSON lines:
+
+    {"id": 1, "puzzle": "4.....8.5.3..........7......", "solver": "dlx", "timeout": 2}
+    {"op": "stats"}
+
+and get one JSON line back per request, in completion order, so answers carry
+the request's id:
+
+    {"id": 1, "status": "solved", "solution": "417369825...", "time": 0.0012,
+     "latency": 0.0031}
+
+Requests go into a bounded queue; when it is full the service answers
+"busy" at once instead of queueing without limit. A batcher drains the queue
+in micro-batches (whatever arrives within BATCH_WINDOW, up to BATCH_SIZE),
+groups them by solver and size, and spreads each group over a pool of worker
+processes. The workers stay warm: each one builds the topology, CNF and
+exact-cover caches of the common sizes on start and keeps them. A request's
+deadline covers its time in the queue as well; past it the puzzle is not
+solved at all and the answer is "timeout". The stats request returns the
+counters and latency histograms of every solver.
+
+    python server.py --socket /tmp/sudoku.sock --workers 4
+'''
+
+from __future__ import print_function
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import decorators
+from budget import *
+from dlx import exact_cover
+from encoding import cnf_template
+from main import DEFAULT_SOLVER, SIZES, load_solver
+from sudoku import SYMBOLS, Grid, puzzle_size, solution_string
+from topology import topology
+
+# The solvers (names from main.SOLVERS) a request may ask for. The others
+# start processes of their own.
+SOLVERS = ('pro', 'dlx', 'naive', 'sat', 'sat-native')
+
+SOCKET = '/tmp/sudoku.sock'
+
+# Seconds a request may take, queueing included, unless it asks otherwise.
+DEFAULT_TIMEOUT = 10.0
+
+# Requests waiting to be batched; past this the service answers "busy".
+QUEUE_SIZE = 4096
+
+# A micro-batch closes BATCH_WINDOW seconds after its first request or at
+# BATCH_SIZE requests, whichever comes first.
+BATCH_WINDOW = 0.002
+BATCH_SIZE = 256
+
+# Puzzles per task sent to a worker. Smaller chunks answer the first puzzles
+# of a big batch sooner; larger ones pickle less.
+CHUNK_SIZE = 16
+
+# Sizes whose caches every worker builds on start.
+WARM_SIZES = (9, 16)
+
+# Upper bounds of the latency histogram buckets, in milliseconds; the last
+# bucket holds everything slower.
+BOUNDS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+LIMIT = 1 << 20  # Longest request line, in bytes
+
+
+def _init_worker(sizes):
+    decorators.verbose = False
+    for size in sizes:
+        topology(size)
+        cnf_template(size)
+        exact_cover(size)
+
+
+def _solve_batch(name, size, items):
+    """Solve (puzzle, seconds left) items in a worker; a list of (status,
+    solution or None, solve time, error message or None). A puzzle that
+    fails only answers its own request with 'error'."""
+    results = []
+    for puzzle, timeout in items:
+        try:
+            s = load_solver(name)(Grid(puzzle, size), size, 'service.cnf',
+                                  budget=Budget(timeout))
+            t, ok = s.solve()
+        except Exception as e:
+            results.append(('error', None, 0., str(e)))
+            continue
+        results.append((s.status, solution_string(s.sigma, size) if ok else None, t, None))
+    return results
+
+
+class Histogram:
+    "Latencies counted in BOUNDS buckets, in milliseconds."
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        k = 0
+        while k < len(BOUNDS) and ms > BOUNDS[k]:
+            k += 1
+        self.counts[k] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q):
+        "Upper bound of the bucket holding the q-quantile (None past the last bound)."
+        if not self.count:
+            return 0.
+        seen = 0
+        for bound, n in zip(BOUNDS + (None,), self.counts):
+            seen += n
+            if seen >= q * self.count:
+                return bound
+
+    def as_dict(self):
+        return {'count': self.count, 'mean': self.total / self.count if self.count else 0.,
+                'max': self.max, 'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+                'bounds': BOUNDS, 'buckets': self.counts}
+
+
+class Request:
+    __slots__ = ('id', 'puzzle', 'solver', 'size', 'deadline', 'received', 'future')
+
+    def __init__(self, id, puzzle, solver, size, timeout):
+        self.id = id
+        self.puzzle = puzzle
+        self.solver = solver
+        self.size = size
+        self.received = time.monotonic()
+        self.deadline = self.received + timeout
+        self.future = asyncio.get_event_loop().create_future()
+
+
+class Service:
+    """The asyncio front end, the batcher and the worker pool. serve() runs
+    until stop() is called."""
+
+    def __init__(self, workers=None, queue_size=QUEUE_SIZE, window=BATCH_WINDOW,
+                 batch_size=BATCH_SIZE, warm_sizes=WARM_SIZES):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.window = window
+        self.batch_size = batch_size
+        self.warm_sizes = warm_sizes
+        self.started = time.time()
+        self.statuses = {}
+        self.latency = {}
+        self.solve_time = {}
+        self.batches = self.batched = self.rejected = 0
+
+    async def serve(self, path=SOCKET, host=None, port=None):
+        self.queue = asyncio.Queue(self.queue_size)
+        self.slots = asyncio.Semaphore(2 * self.workers)  # Chunks in flight
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                        initargs=(self.warm_sizes,))
+        # Start the workers and build their caches now, not on the first
+        # requests, without blocking the event loop meanwhile.
+        await asyncio.gather(*[asyncio.wrap_future(self.pool.submit(os.getpid))
+                               for _ in range(self.workers)])
+        self.done = asyncio.Event()
+        if port is not None:
+            server = await asyncio.start_server(self.handle, host or '127.0.0.1', port,
+                                                limit=LIMIT)
+        else:
+            if os.path.exists(path):
+                os.unlink(path)
+            server = await asyncio.start_unix_server(self.handle, path, limit=LIMIT)
+
+        batcher = asyncio.ensure_future(self.batcher())
+        try:
+            await self.done.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            batcher.cancel()
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            if port is None and os.path.exists(path):
+                os.unlink(path)
+
+    def stop(self):
+        self.done.set()
+
+    async def handle(self, reader, writer):
+        "Answer the JSON lines of one connection, each as soon as it is done."
+        pending = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ValueError, ConnectionError):
+                    break  # Line over LIMIT or connection reset
+                if not line:
+                    break
+                if line.strip():
+                    task = asyncio.ensure_future(self.answer(line, writer))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.wait(pending)
+        finally:
+            writer.close()
+
+    async def answer(self, line, writer):
+        response = await self.respond(line)
+        writer.write(json.dumps(response).encode('ascii') + b'\n')
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def respond(self, line):
+        message = None
+        try:
+            message = json.loads(line)
+            if message.get('op') == 'stats':
+                return self.stats()
+            request = self.parse(message)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            self.statuses['error'] = self.statuses.get('error', 0) + 1
+            return {'id': message.get('id') if isinstance(message, dict) else None,
+                    'status': 'error', 'error': str(e)}
+
+        try:
+            self.queue.put_nowait(request)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return self.finish(request, 'busy')
+        return await request.future
+
+    def parse(self, message):
+        puzzle = message['puzzle']
+        size = int(message.get('size') or puzzle_size(puzzle))
+        if size not in SIZES:
+            raise ValueError('size must be one of {}, not {}'.format(SIZES, size))
+        if len(puzzle) < size * size:
+            raise ValueError('expected {} cells, got {}'.format(size * size, len(puzzle)))
+        symbols = SYMBOLS[:size]
+        if not set(puzzle[:size * size]) <= set('.0' + symbols + symbols.lower()):
+            raise ValueError('puzzle has characters other than . and ' + symbols)
+        solver = message.get('solver', DEFAULT_SOLVER)
+        if solver not in SOLVERS:
+            raise ValueError('unknown solver ' + repr(solver))
+        timeout = float(message.get('timeout') or DEFAULT_TIMEOUT)
+        return Request(message.get('id'), puzzle, solver, size, timeout)
+
+    async def batcher(self):
+        "Collect micro-batches from the queue and dispatch them."
+        loop = asyncio.get_event_loop()
+        while True:
+            batch = [await self.queue.get()]
+            closes = loop.time() + self.window
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                left = closes - loop.time()
+                if left <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), left))
+                except asyncio.TimeoutError:
+                    break
+
+            self.batches += 1
+            self.batched += len(batch)
+            groups = {}
+            for request in batch:
+                groups.setdefault((request.solver, request.size), []).append(request)
+            for (solver, size), requests in groups.items():
+                step = min(-(-len(requests) // self.workers), CHUNK_SIZE)
+                for k in range(0, len(requests), step):
+                    await self.slots.acquire()
+                    asyncio.ensure_future(self.dispatch(solver, size, requests[k:k + step]))
+
+    async def dispatch(self, solver, size, requests):
+        "Solve one chunk in the pool and answer its requests."
+        try:
+            now = time.monotonic()
+            live = []
+            for request in requests:
+                if request.deadline <= now:
+                    self.resolve(request, self.finish(request, TIMEOUT))
+                else:
+                    live.append(request)
+            if not live:
+                return
+
+            items = [(r.puzzle, r.deadline - now) for r in live]
+            try:
+                results = await asyncio.get_event_loop().run_in_executor(
+                    self.pool, _solve_batch, solver, size, items)
+            except Exception as e:
+                for request in live:
+                    self.resolve(request, self.finish(request, 'error', error=str(e)))
+                return
+
+            for request, (status, solution, t, error) in zip(live, results):
+                if error is not None:
+                    self.resolve(request, self.finish(request, status, error=error))
+                    continue
+                self.solve_time.setdefault(solver, Histogram()).add(t)
+                self.resolve(request, self.finish(request, status, solution=solution, time=t))
+        finally:
+            self.slots.release()
+
+    def resolve(self, request, response):
+        if not request.future.done():
+            request.future.set_result(response)
+
+    def finish(self, request, status, **fields):
+        "The response to a request, counted in the stats."
+        latency = time.monotonic() - request.received
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.latency.setdefault(request.solver, Histogram()).add(latency)
+        fields.update(id=request.id, status=status, latency=latency)
+        return fields
+
+    def stats(self):
+        return {'uptime': time.time() - self.started, 'workers': self.workers,
+                'queued': self.queue.qsize(), 'queue_size': self.queue_size,
+                'rejected': self.rejected, 'batches': self.batches,
+                'mean_batch': float(self.batched) / self.batches if self.batches else 0.,
+                'statuses': self.statuses,
+                'latency': dict((k, h.as_dict()) for k, h in self.latency.items()),
+                'solve_time': dict((k, h.as_dict()) for k, h in self.solve_time.items())}
+
+
+class Client:
+    """A blocking client, one request at a time:
+
+        with Client('/tmp/sudoku.sock') as c:
+            c.solve(puzzle)['solution']"""
+
+    def __init__(self, path=SOCKET, host=None, port=None):
+        if port is not None:
+            self.sock = socket.create_connection((host or '127.0.0.1', port))
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path)
+        self.file = self.sock.makefile('rb')
+
+    def request(self, message):
+        self.sock.sendall(json.dumps(message).encode('ascii') + b'\n')
+        return json.loads(self.file.readline())
+
+    def solve(self, puzzle, solver=DEFAULT_SOLVER, timeout=None):
+        return self.request({'puzzle': puzzle, 'solver': solver, 'timeout': timeout})
+
+    def stats(self):
+        return self.request({'op': 'stats'})
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--socket', default=SOCKET, help='Unix socket path')
+    parser.add_argument('--host', help='serve localhost TCP instead (with --port)')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--workers', type=int, help='worker processes (default: CPUs)')
+    parser.add_argument('--queue', type=int, default=QUEUE_SIZE)
+    parser.add_argument('--window', type=float, default=BATCH_WINDOW,
+                        help='micro-batch window in seconds')
+    parser.add_argument('--batch', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    service = Service(args.workers, args.queue, args.window, args.batch)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, service.stop)
+    loop.run_until_complete(service.serve(args.socket, args.host, args.port))
+    loop.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
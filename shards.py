@@ -0,0 +1,407 @@
+'''
+Sharded bulk runs that pick up where they stopped.
+
+A run splits a puzzle file into shards and keeps everything in one directory:
+
+    manifest.json          the source, solver and number of shards
+    input/00000.txt        the puzzles of each shard, one per line
+    claims/00000.0         held by the worker solving shard 0
+    checkpoints/00000.txt  the result lines of an unfinished shard so far
+    results/00000.txt      the result lines of a finished shard
+
+A result line is 'status<TAB>nanoseconds<TAB>solution'. A puzzle line that is
+malformed, or that the solver fails on, gets the status 'error' and no
+solution; prepare() counts the malformed ones up front. Files are written
+under a temporary name, synced and renamed into place, so a reader (or a
+resumed run) sees either all of a file or none of it.
+
+The claims are the work queue. Worker processes, on this machine or on others
+sharing the directory, claim a shard by creating its claim file with
+O_EXCL, so exactly one of them gets it. A worker touches its claim whenever
+it checkpoints. A claim is taken over by creating the next generation
+(claims/00000.1, ...), again with O_EXCL. This happens when the claim's
+process is dead (on this host), or when it has not been touched for LEASE
+seconds. The new owner starts from the shard's checkpoint, and shards in
+results/ are never solved again. So an interrupted run loses at most
+CHECKPOINT_INTERVAL seconds of work per shard in progress.
+
+merge() writes every solution in input order, in the format of
+stream.write_solutions, and the aggregate timing statistics as JSON.
+
+    python shards.py run puzzles.txt.gz runs/big --solver dlx --workers 4
+    python shards.py work runs/big                 # Another machine helping
+    python shards.py status runs/big
+    python shards.py merge runs/big solutions.txt.gz
+'''
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import decorators
+from decorators import quiet
+
+SHARD_SIZE = 1000
+
+# Seconds between the checkpoints (and claim heartbeats) of a shard.
+CHECKPOINT_INTERVAL = 10
+
+# Seconds without a heartbeat after which another worker takes a claim over.
+# Keep it well above the longest single solve (see --timeout).
+LEASE = 600
+
+DEFAULT_SOLVER = 'dlx'
+
+MANIFEST = 'manifest.json'
+DIRECTORIES = ('input', 'claims', 'checkpoints', 'results')
+
+
+def worker_id():
+    "This process, as written in its claims: 'host pid'."
+    return '{} {}'.format(socket.gethostname(), os.getpid())
+
+
+def write_atomic(path, data):
+    """Write bytes to path through a temporary file and a rename, so the
+    path holds either its old content or all of data."""
+    tmp = '{}.{}.tmp'.format(path, worker_id().replace(' ', '.'))
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_lines(path):
+    "The lines of a text file, or [] if it does not exist."
+    try:
+        with open(path) as f:
+            return f.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+
+def line_error(puzzle, size):
+    "Why a puzzle line of a run of the given size cannot be solved, or None."
+    from main import puzzle_error
+    from sudoku import puzzle_size
+
+    error = puzzle_error(puzzle)
+    if error is None and puzzle_size(puzzle) != size:
+        error = 'not a {0}x{0} puzzle'.format(size)
+    return error
+
+
+def prepare(source, path, solver=DEFAULT_SOLVER, timeout=None, shard_size=SHARD_SIZE):
+    """Split the puzzles of source into shards under path and return the Run.
+    If path already holds a run of the same source and settings, it is
+    returned as it is, so preparing again is how a run resumes. The size is
+    that of the first well-formed puzzle; the manifest's 'malformed' counts
+    the lines that will get error results."""
+    from main import puzzle_error
+    from stream import read_puzzles
+    from sudoku import puzzle_size
+
+    settings = {'source': os.path.abspath(source), 'solver': solver,
+                'timeout': timeout, 'shard_size': shard_size}
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        run = Run(path)
+        for key, value in settings.items():
+            if run.manifest[key] != value:
+                raise ValueError('{} already holds a run with {} {!r}, not {!r}'
+                                 .format(path, key, run.manifest[key], value))
+        return run
+
+    for d in DIRECTORIES:
+        os.makedirs(os.path.join(path, d), exist_ok=True)
+    puzzles = read_puzzles(source)
+    shards = count = size = malformed = 0
+    while True:
+        shard = list(islice(puzzles, shard_size))
+        if not shard:
+            break
+        for p in shard:
+            if not size and puzzle_error(p) is None:
+                size = puzzle_size(p)
+            malformed += line_error(p, size) is not None
+        write_atomic(os.path.join(path, 'input', '{:05d}.txt'.format(shards)),
+                     ''.join(p + '\n' for p in shard).encode('ascii'))
+        shards += 1
+        count += len(shard)
+
+    # Written last: a directory with a manifest holds every shard.
+    settings.update(shards=shards, puzzles=count, size=size, malformed=malformed)
+    write_atomic(os.path.join(path, MANIFEST),
+                 json.dumps(settings, indent=2, sort_keys=True).encode('ascii'))
+    return Run(path)
+
+
+def _work(path):
+    decorators.verbose = False
+    return Run(path).work()
+
+
+class Run:
+    "A prepared run directory. See the module docstring for its layout."
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.shards = self.manifest['shards']
+        self.size = self.manifest['size']
+
+    def file(self, kind, k):
+        return os.path.join(self.path, kind, '{:05d}.txt'.format(k))
+
+    def claim_file(self, k, generation):
+        return os.path.join(self.path, 'claims', '{:05d}.{}'.format(k, generation))
+
+    def claims(self):
+        "The highest claim generation of each claimed shard."
+        claims = {}
+        for name in os.listdir(os.path.join(self.path, 'claims')):
+            k, _, generation = name.partition('.')
+            if generation.isdigit():
+                claims[int(k)] = max(claims.get(int(k), -1), int(generation))
+        return claims
+
+    def finished(self):
+        return set(int(name[:-4]) for name in os.listdir(os.path.join(self.path, 'results'))
+                   if name.endswith('.txt'))
+
+    def stale(self, path):
+        """Whether the worker holding a claim is gone: a dead process on this
+        host, or no heartbeat for LEASE seconds."""
+        try:
+            with open(path) as f:
+                host, _, pid = f.read().partition(' ')
+            touched = os.path.getmtime(path)
+        except FileNotFoundError:
+            return False  # Finished and released meanwhile
+        if host == socket.gethostname() and pid.isdigit():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+        return time.time() - touched > LEASE
+
+    def claim(self, k, generation):
+        "Try to create the given claim generation of shard k."
+        try:
+            fd = os.open(self.claim_file(k, generation), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(worker_id())
+        return True
+
+    def owns(self, k, generation):
+        "False once another worker has taken the claim over."
+        return not os.path.exists(self.claim_file(k, generation + 1))
+
+    def next_shard(self):
+        """Claim the first shard that is neither finished nor held by a live
+        worker. Return (shard, claim generation), or None when none is left."""
+        finished, claims = self.finished(), self.claims()
+        for k in range(self.shards):
+            if k in finished:
+                continue
+            generation = claims.get(k, -1)
+            if generation >= 0 and not self.stale(self.claim_file(k, generation)):
+                continue
+            if self.claim(k, generation + 1):
+                return k, generation + 1
+        return None
+
+    def work(self):
+        """Solve shards until none is left to claim. Return the number of
+        shards finished by this worker."""
+        done = 0
+        while True:
+            claimed = self.next_shard()
+            if claimed is None:
+                return done
+            done += self.solve_shard(*claimed)
+
+    def solve_shard(self, k, generation):
+        """Solve shard k from its checkpoint on, checkpointing every
+        CHECKPOINT_INTERVAL seconds. Return False if the claim was taken over
+        meanwhile (the new owner carries on from the last checkpoint)."""
+        from main import load_solver
+        from sudoku import Grid, solution_string
+
+        solver = load_solver(self.manifest['solver'], self.manifest['timeout'])
+        size, claim = self.size, self.claim_file(k, generation)
+        lines = read_lines(self.file('checkpoints', k))
+        puzzles = read_lines(self.file('input', k))
+        last = time.monotonic()
+        with quiet():
+            for i in range(len(lines), len(puzzles)):
+                t = time.perf_counter_ns()
+                try:
+                    error = line_error(puzzles[i], size)
+                    if error:
+                        raise ValueError(error)
+                    s = solver(Grid(puzzles[i], size), size, 'shard{}_{}.cnf'.format(k, i))
+                    _, solved = s.solve()
+                    status = s.status
+                    solution = solution_string(s.sigma, size) if solved else ''
+                except Exception:
+                    status, solution = 'error', ''  # Only this puzzle fails
+                t = time.perf_counter_ns() - t
+                lines.append('{}\t{}\t{}'.format(status, t, solution))
+
+                if time.monotonic() - last > CHECKPOINT_INTERVAL and i + 1 < len(puzzles):
+                    if not self.owns(k, generation):
+                        return False
+                    write_atomic(self.file('checkpoints', k),
+                                 ''.join(line + '\n' for line in lines).encode('ascii'))
+                    os.utime(claim)
+                    last = time.monotonic()
+
+        if not self.owns(k, generation):
+            return False
+        write_atomic(self.file('results', k),
+                     ''.join(line + '\n' for line in lines).encode('ascii'))
+        for path in [self.file('checkpoints', k)] + \
+                [self.claim_file(k, g) for g in range(generation + 1)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return True
+
+    def run(self, workers=None):
+        """Work on the run with `workers` processes (0 works in this process).
+        Return the number of shards they finished."""
+        if workers == 0:
+            return self.work()
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(workers) as pool:
+            return sum(pool.map(_work, [self.path] * workers))
+
+    def progress(self):
+        """Counts of finished, claimed and waiting shards, and the puzzles
+        done so far (checkpointed ones included)."""
+        finished, claims = self.finished(), self.claims()
+        puzzles = 0
+        for k in range(self.shards):
+            if k in finished:
+                puzzles += len(read_lines(self.file('results', k)))
+            else:
+                puzzles += len(read_lines(self.file('checkpoints', k)))
+        claimed = len(set(claims) - finished)
+        return {'shards': self.shards, 'finished': len(finished), 'claimed': claimed,
+                'waiting': self.shards - len(finished) - claimed,
+                'puzzles': self.manifest['puzzles'], 'done': puzzles}
+
+    def merge(self, output, stats=None):
+        """Write the solutions of every shard, in input order, to output ('.gz'
+        compresses) and return the aggregate statistics, also saved as JSON
+        to stats (default: stats.json in the run directory). Times are in
+        milliseconds, as in benchmark.py. 'invalid' counts the solutions that
+        validate.check rejects."""
+        from benchmark import summarize
+        from stream import write_solutions
+        from validate import check
+
+        missing = sorted(set(range(self.shards)) - self.finished())
+        if missing:
+            raise RuntimeError('{} of {} shards are not finished (first: {})'
+                               .format(len(missing), self.shards, missing[0]))
+
+        samples, statuses, invalid = [], {}, [0]
+
+        def solutions():
+            for k in range(self.shards):
+                solved, puzzles = [], read_lines(self.file('input', k))
+                for i, line in enumerate(read_lines(self.file('results', k))):
+                    status, t, solution = line.split('\t')
+                    statuses[status] = statuses.get(status, 0) + 1
+                    samples.append(int(t))
+                    if solution:
+                        solved.append((solution, puzzles[i]))
+                    yield solution or None
+                if solved:
+                    grids, givens = zip(*solved)
+                    invalid[0] += int((~check(grids, givens, self.size)).sum())
+
+        # The temporary file keeps the extension, so '.gz' still compresses.
+        root, ext = os.path.splitext(output)
+        tmp = '{}.{}.tmp{}'.format(root, os.getpid(), ext)
+        write_solutions(tmp, solutions())
+        os.replace(tmp, output)
+
+        result = {'puzzles': len(samples), 'shards': self.shards,
+                  'solver': self.manifest['solver'], 'statuses': statuses,
+                  'invalid': invalid[0], 'total_seconds': sum(samples) / 1e9}
+        if samples:
+            result.update(summarize(samples))
+        write_atomic(stats or os.path.join(self.path, 'stats.json'),
+                     json.dumps(result, indent=2, sort_keys=True).encode('ascii'))
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    p = commands.add_parser('run', help='prepare (or resume) a run and work on it')
+    p.add_argument('source', help='puzzle file (.gz too)')
+    p.add_argument('path', help='run directory')
+    p.add_argument('--solver', default=DEFAULT_SOLVER)
+    p.add_argument('--timeout', type=float, help='seconds per puzzle')
+    p.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+    p.add_argument('--workers', type=int,
+                   help='worker processes (0 works here; default: CPUs)')
+    p.add_argument('--output', help='merge the solutions here once every shard is done')
+
+    p = commands.add_parser('work', help='work on a prepared run, e.g. from another machine')
+    p.add_argument('path')
+    p.add_argument('--workers', type=int)
+
+    p = commands.add_parser('status', help='show the progress of a run')
+    p.add_argument('path')
+
+    p = commands.add_parser('merge', help='write the solutions and statistics of a run')
+    p.add_argument('path')
+    p.add_argument('output')
+    p.add_argument('--stats', help='statistics JSON (default: PATH/stats.json)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        run = prepare(args.source, args.path, args.solver, args.timeout, args.shard_size)
+        if run.manifest.get('malformed'):
+            print('{} malformed puzzle lines will get error results'
+                  .format(run.manifest['malformed']))
+    else:
+        run = Run(args.path)
+
+    if args.command in ('run', 'work'):
+        run.run(args.workers)
+    progress = run.progress()
+    if args.command == 'merge' or args.command == 'run' and args.output and \
+            progress['finished'] == progress['shards']:
+        stats = run.merge(args.output, getattr(args, 'stats', None))
+        statuses = ', '.join('{} {}'.format(n, s) for s, n in sorted(stats['statuses'].items()))
+        print('{} puzzles, {}, {} invalid; median {:.3f} ms, p99 {:.3f} ms, {:.1f} s in all'
+              .format(stats['puzzles'], statuses, stats['invalid'], stats.get('median', 0),
+                      stats.get('p99', 0), stats['total_seconds']))
+
+    print('{finished}/{shards} shards finished, {claimed} claimed, {waiting} waiting; '
+          '{done}/{puzzles} puzzles done'.format(**progress))
+    return 0 if progress['finished'] == progress['shards'] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
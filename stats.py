@@ -0,0 +1,56 @@
+'''
+Per-solve statistics.
+
+Every solver keeps a Stats record, solver.stats, and fills it in as it goes.
+Counters are bumped once per search node, failed branch or forced assignment,
+never per candidate looked at, so they cost next to nothing. Set
+stats.on_node to a callable(searcher, depth) to be called at every search
+node; searcher is the solver, or the ExactCover matrix for DLXSolver. While
+it is None, the default, the only cost is testing for it.
+'''
+
+
+class Stats:
+    """What one solve did. Fields that do not apply to a solver stay 0.
+
+    time, status        as returned by / set after solve() or count(), in seconds
+    nodes               search nodes expanded
+    backtracks          branches that failed and were undone
+    max_depth           deepest search node (branching decisions, not givens)
+    eliminations        candidates removed by propagation (ProSolver)
+    hidden_singles      assignments forced by a digit with one place left
+    pointing, box_line, naked_pairs, hidden_pairs
+                        candidates removed directly by each ProSolver
+                        inference rule, before propagation
+    intersection_time, pair_time
+                        seconds spent in those rules (ProSolver)
+    propagations        PicoSAT propagations (SATSolver)
+    variables, clauses  size of the CNF handed to the SAT solver
+    encode_time, write_time, solve_time, parse_time
+                        SATSolver phases: building the CNF, serializing it
+                        to DIMACS (picosat backend), the SAT solver itself
+                        and reading the model back, in seconds"""
+
+    FIELDS = ('status', 'time', 'nodes', 'backtracks', 'max_depth', 'eliminations',
+              'hidden_singles', 'pointing', 'box_line', 'naked_pairs', 'hidden_pairs',
+              'intersection_time', 'pair_time', 'propagations', 'variables', 'clauses',
+              'encode_time', 'write_time', 'solve_time', 'parse_time')
+
+    def __init__(self):
+        for k in self.FIELDS:
+            setattr(self, k, 0)
+        self.status = None
+        self.on_node = None
+
+    def finish(self, solver, t):
+        "Record the outcome of solver.solve() or count(), which took t seconds."
+        self.time = t
+        self.status = solver.status
+        self.nodes = solver.budget.nodes
+
+    def as_dict(self):
+        return dict((k, getattr(self, k)) for k in self.FIELDS)
+
+    def __repr__(self):
+        return 'Stats({})'.format(', '.join(
+            '{}={}'.format(k, getattr(self, k)) for k in self.FIELDS if getattr(self, k)))
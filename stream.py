@@ -0,0 +1,58 @@
+'''
+Streaming puzzle files through a solver.
+
+Puzzle files hold one puzzle per line in the compact format (81 characters for
+9x9, 256 for 16x16, '.' for an empty cell) and may be gzip-compressed ('.gz').
+Files are read and written through large buffers one line at a time, so memory
+stays constant however many puzzles a file holds.
+'''
+
+import gzip
+import io
+
+from parallel import solve_many
+from sudoku import ProSolver, solve_puzzle
+
+BUFFER_SIZE = 1 << 20
+
+
+def _open(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return io.open(path, mode, buffering=BUFFER_SIZE)
+
+
+def read_puzzles(path):
+    "Yield the puzzle strings of a file, skipping blank lines and '#' comments."
+    with _open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith(b'#'):
+                yield line.decode('ascii')
+
+
+def write_solutions(path, solutions):
+    """Write one solution per line. None (no solution found) is written as an
+    empty line, so line n of the output always answers line n of the input.
+    Return the number of lines written."""
+    n = 0
+    with _open(path, 'wb') as f:
+        for solution in solutions:
+            f.write((solution or '').encode('ascii') + b'\n')
+            n += 1
+    return n
+
+
+def solve_file(source, target, solver=ProSolver, workers=None, chunksize=64):
+    """Solve every puzzle of `source` and write the solutions, in input order,
+    to `target`. workers=0 solves in this process; otherwise the puzzles are
+    spread over a process pool with parallel.solve_many. Return the number of
+    puzzles processed."""
+    puzzles = read_puzzles(source)
+    if workers == 0:
+        solutions = (solve_puzzle(p, solver, filename='stream.cnf')
+                     for p in puzzles)
+    else:
+        solutions = (s for _, s in solve_many(puzzles, solver, workers=workers,
+                                              chunksize=chunksize, ordered=True))
+    return write_solutions(target, solutions)
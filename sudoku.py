@@ -4,236 +4,647 @@ http://norvig.com/sudoku.html
 '''
 
 from __future__ import print_function
-import random
-import copy
-import pycosat
-from math import sqrt
-from subprocess import Popen, PIPE
+import re
+from itertools import chain
+from time import perf_counter
+from budget import *
 from decorators import *
+from stats import Stats
+from topology import topology
 
 
-HEX_REP = {1: '1', 2: '2', 3: '3', 4: '4', 5: '5', 6: '6', 7: '7', 8: '8', 9: '9',
-           10: 'A', 11: 'B', 12: 'C', 13: 'D', 14: 'E', 15: 'F', 16: 'G'}
+# Without a budget the naive search can run for minutes on a hard puzzle.
+NAIVE_TIMEOUT = 5
+
+# pycosat cannot be interrupted, so it runs in slices of this many
+# propagations (doubling each time) with the budget checked in between. Each
+# slice starts over, so a timeout can overrun by up to one slice.
+PYCOSAT_SLICE = 1 << 18
+
+# The positive literals of a model printed by the picosat binary.
+POSITIVE = re.compile(br' ([1-9][0-9]*)')
+
+# ProSolver inference levels, weakest first.
+INFERENCE = ('singles', 'intersections', 'pairs')
+
+# The SAT backends (pycosat, NumPy for the CNF, the native library, the
+# picosat subprocess), dlx and canonical are imported by the solvers that use
+# them when they first solve, so importing this module stays cheap.
+
+# Digit d is written SYMBOLS[d - 1]: 1-9, then letters, then 0 for 36x36.
+SYMBOLS = '123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ0'
+HEX_REP = dict(enumerate(SYMBOLS, 1))
+
+
+try:
+    popcount = int.bit_count  # Number of candidates left in a bitmask
+except AttributeError:
+    def popcount(m):
+        return bin(m).count('1')
+
+
+def puzzle_size(problem):
+    "Board size of a puzzle string (81 characters -> 9, 256 -> 16)."
+    return int(round(len(problem) ** 0.5))
+
+
+_DIGIT_TABLES = {}
+
+
+def digit_table(size):
+    """A bytes.translate table from character code to digit for boards of
+    the given size. Symbols past the size, '.' and '0' (below 36x36) are 0."""
+    try:
+        return _DIGIT_TABLES[size]
+    except KeyError:
+        table = bytearray(256)
+        for d, c in HEX_REP.items():
+            if d <= size:
+                table[ord(c)] = table[ord(c.lower())] = d
+        t = _DIGIT_TABLES[size] = bytes(table)
+        return t
+
+
+def print_board(size, digits):
+    "Print the digits of a board in cell order, boxes separated, 0 as '.'."
+    box = topology(size).box
+    for i in range(size):
+        row = ''.join(HEX_REP[d] if d else '.' for d in digits[i * size:(i + 1) * size])
+        print(' | '.join(row[j:j + box] for j in range(0, size, box)))
+        if i % box == box - 1 and i != size - 1:
+            print('-' * (size + (box - 1) * 3))
+
+
+def solution_string(sigma, size):
+    "Format a solved sigma in the same one-line format as the puzzles."
+    return ''.join(HEX_REP[sigma[spot]] for spot in topology(size).spots)
+
+
+def solve_puzzle(problem, solver, size=None, filename='puzzle.cnf'):
+    """Solve one puzzle string without displaying anything. Return the solution
+    string, or None if the solver found no solution."""
+    size = size or puzzle_size(problem)
+    s = solver(Grid(problem, size), size, filename)
+    with quiet():
+        _, solved = s.solve()
+    return solution_string(s.sigma, size) if solved else None
+
+
+def count_solutions(problem, limit=2, solver=None, size=None, budget=None):
+    """Count the solutions of a puzzle string, stopping at limit; a puzzle is
+    unique when this returns 1 with limit=2. solver is ProSolver or SATSolver
+    (e.g. partial(SATSolver, backend='native')). Return None if the budget
+    ran out first."""
+    size = size or puzzle_size(problem)
+    solver = solver or ProSolver
+    return solver(Grid(problem, size), size, 'count.cnf', budget=budget).count(limit)
 
 
 class Grid:
+    """The candidate state of one puzzle. Everything that only depends on the
+    size (spots, peers, units) lives in the shared Topology."""
+    __slots__ = ('size', 'topology', 'givens')
+
     def __init__(self, problem, size):
         self.size = size
-        self.spots = [(i, j) for i in range(1, size + 1)
-                      for j in range(1, size + 1)]
-        self.domains = {}
-        self.peers = {}  # Need a dictionary that maps each spot to its related spots
-        self.units = {}
-
-        self.parse(problem)
-        self.set_peers()
-        self.set_units()
+        self.topology = topology(size)
+        self.givens = self.parse(problem)  # Given digit per cell, 0 if empty
 
     def parse(self, problem):
-        for i in range(0, self.size):
-            for j in range(0, self.size):
-                problem[i * self.size + j]
-                c = problem[i * self.size + j].upper()
-                if c == '.':
-                    self.domains[(i + 1, j + 1)] = range(1, self.size + 1)
-                else:
-                    self.domains[(i + 1, j + 1)] = [ord(c) -
-                                                    48] if ord(c) <= 57 else [ord(c) - 55]
-
-    def set_peers(self):
-        x = int(sqrt(self.size))
-        for i in range(0, self.size):
-            for j in range(0, self.size):
-                row = [(i + 1, k + 1) for k in range(0, self.size) if k != j]
-                col = [(k + 1, j + 1) for k in range(0, self.size) if k != i]
-                sqr = [(k + 1, l + 1) for k in range(i // x * x, i // x * x + x)
-                       for l in range(j // x * x, j // x * x + x) if (i, j) != (k, l)]
-
-                self.peers[(i + 1, j + 1)] = set(row + col + sqr)
-
-    def set_units(self):
-        x = int(sqrt(self.size))
-        for i in range(0, self.size):
-            for j in range(0, self.size):
-                row = [(i + 1, k + 1) for k in range(0, self.size)]
-                col = [(k + 1, j + 1) for k in range(0, self.size)]
-                sqr = [(k + 1, l + 1) for k in range(i // x * x, i // x * x + x)
-                       for l in range(j // x * x, j // x * x + x)]
-
-                self.units[(i + 1, j + 1)] = [row, col, sqr]
+        cells = self.topology.cells
+        if len(problem) < cells:
+            raise ValueError('a {0}x{0} puzzle needs {1} cells, got {2}'.format(
+                self.size, cells, len(problem)))
+        problem = problem[:cells].encode('ascii')
+        return bytearray(problem.translate(digit_table(self.size)))
 
     def display(self):
-        for i in range(0, self.size):
-            for j in range(0, self.size):
-                d = self.domains[(i + 1, j + 1)]
-                if len(d) == 1:
-                    s = HEX_REP[d[0]]
-                    print(s, end='')
-                else:
-                    print('.', end='')
-
-                if self.size == 9:
-                    if j == 2 or j == 5:
-                        print(" | ", end='')
-                elif self.size == 16:
-                    if j == 3 or j == 7 or j == 11:
-                        print(" | ", end='')
-            print()
-            if self.size == 9:
-                if i == 2 or i == 5:
-                    print("---------------")
-            elif self.size == 16:
-                if i == 3 or i == 7 or i == 11:
-                    print("-------------------------")
+        print_board(self.size, self.givens)
 
 
 class NaiveSolver:
-    def __init__(self, grid, size, filename):
+    """Plain backtracking without inference. Used values are kept as row,
+    column and box bitmasks updated on assign/unassign, so checking a value
+    and picking the next cell are both constant-time."""
+
+    def __init__(self, grid, size, filename, budget=None):
         self.size = size
         self.grid = grid
+        self.topology = grid.topology
+        self.budget = budget or Budget(timeout=NAIVE_TIMEOUT)
+        self.status = None
+        self.stats = Stats()
         self.sigma = {}
 
-    @deadline(5)
     @time_deco
     def solve(self):
+        self.budget.start()
         # Filling given information (grids)
-        for spot in self.grid.spots:
-            if len(self.grid.domains[spot]) == 1:
-                self.sigma[spot] = self.grid.domains[spot][0]
+        if not self.initial_assignment():
+            self.status = UNSOLVABLE
+            return False
+        t = self.topology
+        self.lines = [(t.rows[c], t.cols[c], t.boxes[c]) for c in self.order]
+        self.free = [0] * len(self.order)
+        self.level = 0
+        self.expand = True
+        return self.advance()
+
+    @time_deco
+    def resume(self, budget=None):
+        """Carry on a solve that its budget stopped, from the node where it
+        stopped, under budget or the old budget restarted."""
+        if budget is not None:
+            self.budget = budget
+        self.budget.start()
+        return self.advance()
+
+    def advance(self):
+        try:
+            result = self.search()
+        except BudgetExceeded:
+            self.status = self.budget.status()
+            return False
 
-        result = self.backtrack(self.sigma)
+        self.status = SOLVED if result else UNSOLVABLE
+        if result:
+            for spot, d in zip(self.topology.spots, self.values):
+                self.sigma[spot] = d
         return result
 
-    def backtrack(self, sigma):
-        if len(sigma) == len(self.grid.spots):
-            return True
+    def initial_assignment(self):
+        t = self.topology
+        self.values = list(self.grid.givens)
+        self.rows, self.cols, self.boxes = [0] * self.size, [0] * self.size, [0] * self.size
+        for cell, d in enumerate(self.values):
+            if d:
+                bit = 1 << (d - 1)
+                r, c, b = t.rows[cell], t.cols[cell], t.boxes[cell]
+                if (self.rows[r] | self.cols[c] | self.boxes[b]) & bit:
+                    return False  # Two equal givens share a unit
+                self.rows[r] |= bit
+                self.cols[c] |= bit
+                self.boxes[b] |= bit
+
+        # The empty cells, in the order they are filled. The order is fixed
+        # before the search starts (nothing is inferred while searching): next
+        # comes the cell with the most peers already given or ordered, so
+        # conflicts show up as early as possible, then the one with the fewest
+        # values left open by the givens.
+        free = [popcount(t.full & ~(self.rows[t.rows[c]] | self.cols[t.cols[c]] |
+                                    self.boxes[t.boxes[c]]))
+                for c in range(t.cells)]
+        connected = [sum(1 for p in t.peers[c] if self.values[p])
+                     for c in range(t.cells)]
+        left = set(c for c in range(t.cells) if not self.values[c])
+        self.order = []
+        while left:
+            cell = max(left, key=lambda c: (connected[c], -free[c], -c))
+            left.remove(cell)
+            self.order.append(cell)
+            for p in t.peers[cell]:
+                connected[p] += 1
+        return True
 
-        spot = self.select_unassigned_spot()
-        for value in self.grid.domains[spot]:
-            if self.consistent(sigma, spot, value):
-                sigma[spot] = value
-                if self.backtrack(sigma):
+    def search(self):
+        """Fill the cells in order with an explicit stack: free[k] holds the
+        values still to try for the k-th cell. Return True once every cell is
+        filled, False when every value has been tried. If the budget stops it,
+        the next call carries on from the same node."""
+        full, rows, cols, boxes = self.topology.full, self.rows, self.cols, self.boxes
+        values, order, lines, free = self.values, self.order, self.lines, self.free
+        node, stats = self.budget.node, self.stats
+        k, expand = self.level, self.expand
+        try:
+            while True:
+                if expand and k == len(order):
                     return True
 
-            if sigma.get(spot):
-                del sigma[spot]
-
-        return False
-
-    # ---------- HELPERS ---------- #
-    def consistent(self, sigma, spot, value):
-        for peer in self.grid.peers[spot]:
-            if sigma.get(peer) == value:
-                return False
+                r, c, b = lines[k]
+                if expand:
+                    node()
+                    if k > stats.max_depth:
+                        stats.max_depth = k
+                    if stats.on_node is not None:
+                        stats.on_node(self, k)
+
+                    # Only the values not used by the cell's row, column and box are tried.
+                    free[k] = full & ~(rows[r] | cols[c] | boxes[b])
+                    expand = False
+                else:
+                    bit = 1 << (values[order[k]] - 1)  # Undo the value that failed
+                    rows[r] ^= bit
+                    cols[c] ^= bit
+                    boxes[b] ^= bit
+                    stats.backtracks += 1
+
+                m = free[k]
+                if m:
+                    bit = m & -m
+                    free[k] = m ^ bit
+                    rows[r] |= bit
+                    cols[c] |= bit
+                    boxes[b] |= bit
+                    values[order[k]] = bit.bit_length()
+                    k += 1
+                    expand = True
+                else:
+                    values[order[k]] = 0
+                    k -= 1
+                    if k < 0:
+                        return False
+        finally:
+            self.level, self.expand = k, expand
 
-        return True
 
-    def select_unassigned_spot(self):
-        for spot in self.grid.spots:
-            if not self.sigma.get(spot):
-                return spot
+class ProSolver:
+    """Constraint propagation and depth-first search over candidate bitmasks.
 
+    inference picks how much propagation runs at every search node, one of
+    INFERENCE, each level adding to the ones before it: 'singles' (naked and
+    hidden singles only), 'intersections' (pointing and box-line reduction)
+    and 'pairs' (naked and hidden pairs). The stronger levels cut nodes at a
+    cost per node; stats records what each one removed and the time it took."""
 
-class ProSolver:
-    def __init__(self, grid, size, filename):
+    def __init__(self, grid, size, filename, budget=None, inference='singles'):
         self.size = size
         self.grid = grid
+        self.topology = grid.topology
+        self.budget = budget or Budget()
+        self.status = None
+        self.stats = Stats()
         self.sigma = {}
+        self.level = INFERENCE.index(inference)
+
+        # Each cell's candidates are stored as a bitmask, digit d -> 1 << (d - 1).
+        # A search state is that list of cells followed by size + 1 buckets,
+        # counted from the end: state[~k] has bit c set if cell c has k
+        # candidates left, so the MRV cell is found without scanning every cell.
+        self.cells = self.topology.cells
+        self.peers = self.topology.peers
+        self.units = self.topology.cell_units
+        self.trail = []  # (cell, digit) of every candidate removed, in order
+        self.stack = None
 
     @time_deco
     def solve(self):
-        domains = self.initial_assignment()
-        if not domains:
+        self.budget.start()
+        self.stats.eliminations = 0
+        self.stack = None
+        values = self.initial_state()
+        if not values:
+            self.stats.eliminations = self.budget.propagations
+            self.status = UNSOLVABLE
             return False
+        self.begin(values)
+        return self.advance()
 
-        return self.assign_to_sigma(self.sigma, self.search(domains))
-
-    def search(self, values):
-        if values is False:
+    @time_deco
+    def resume(self, budget=None):
+        """Carry on a solve that its budget stopped (status 'timeout' or
+        'cancelled') from the node where it stopped, under budget or the old
+        budget restarted. Returns what solve() would have."""
+        assert self.stack is not None, 'no search to resume'
+        if budget is not None:
+            self.budget = budget
+        self.budget.start()
+        return self.advance()
+
+    def advance(self):
+        "Run the search until it ends or the budget stops it, and record the outcome."
+        try:
+            values = self.search()
+        except BudgetExceeded:
+            self.status = self.budget.status()
             return False
+        finally:
+            self.stats.eliminations += self.budget.propagations
+
+        self.status = SOLVED if values else UNSOLVABLE
+        return self.assign_to_sigma(self.sigma, values)
+
+    @stats_deco
+    def count(self, limit=2):
+        """Count the solutions, stopping at limit, by carrying on the search
+        past each solution. sigma holds the first solution found. Return the
+        count, or None if the budget ran out."""
+        self.budget.start()
+        found = []
+        try:
+            values = self.initial_state()
+            if values:
+                self.begin(values)
+                while len(found) < limit and self.search():
+                    found.append(values[:self.cells])
+        except BudgetExceeded:
+            self.status = self.budget.status()
+            return None
+
+        self.status = SOLVED if found else UNSOLVABLE
+        if found:
+            self.assign_to_sigma(self.sigma, found[0])
+        return len(found)
+
+    def begin(self, values):
+        """Start a search from a propagated state. The search runs on this one
+        state: the stack holds a [cell, digits left to try, trail length]
+        frame per branching decision, and backtracking undoes the trail back
+        to that length instead of restoring a copy."""
+        self.values = values
+        self.stack = []
+        del self.trail[:]  # The givens are never undone
+        self.expand = True
+
+    def search(self):
+        """Depth-first search from where the last call stopped. Return the
+        state once every cell holds a single value (call again for the next
+        solution), or False when the tree is exhausted. If the budget stops it,
+        the next call carries on from the same node."""
+        values, stack, stats, budget = self.values, self.stack, self.stats, self.budget
+        failed = False
+        while True:
+            if self.expand:
+                if not self.level or self.infer(values):
+                    budget.node()
+                    depth = len(stack)
+                    if depth > stats.max_depth:
+                        stats.max_depth = depth
+                    if stats.on_node is not None:
+                        stats.on_node(self, depth)
+
+                    s = self.select_spot(values)
+                    if s == -1:
+                        self.expand = False  # Every cell holds a single value
+                        return values
+                    stack.append([s, values[s], len(self.trail)])
+                else:
+                    failed = True
+                self.expand = False
 
-        if all([len(values[s]) == 1 for s in self.grid.spots]):
-            return values
-
-        _, s = min((len(values[s]), s)
-                   for s in self.grid.spots if len(values[s]) > 1)
-        return self.some(self.search(self.assign(copy.deepcopy(values), s, d))
-                         for d in values[s])
-
-    def some(self, seq):
-        "Return some element of seq that is true."
-        for e in seq:
-            if e:
-                return e
-        return False
+            # Try the next digit of the deepest decision with one left.
+            while True:
+                if not stack:
+                    return False
+                frame = stack[-1]
+                if failed:
+                    stats.backtracks += 1
+                self.undo(frame[2])
+                m = frame[1]
+                if not m:
+                    stack.pop()
+                    failed = True
+                    continue
+                d = m & -m
+                frame[1] = m ^ d
+                if self.assign(values, frame[0], d):
+                    break
+                failed = True
+
+            self.expand = True
+            failed = False
+
+    def undo(self, mark):
+        "Put back the candidates removed since the trail was mark entries long."
+        values, trail = self.values, self.trail
+        while len(trail) > mark:
+            s, d = trail.pop()
+            m = values[s]
+            # Move the cell up one bucket.
+            k = ~popcount(m)
+            bit = 1 << s
+            values[k] ^= bit
+            values[k - 1] |= bit
+            values[s] = m | d
+
+    def select_spot(self, values):
+        "The unsolved cell with the fewest candidates (MRV), or -1 if none."
+        for k in range(-3, -self.size - 2, -1):
+            b = values[k]
+            if b:
+                return (b & -b).bit_length() - 1
+        return -1
 
     def assign(self, values, s, d):
-        """Eliminate all the other values (except d) from values[s] and propagate.
+        """Eliminate all the other values (except bit d) from values[s] and propagate.
         Return values, except return False if a contradiction is detected."""
-
-        other_values = [v for v in values[s] if v != d]
-
-        if all(self.eliminate(values, s, d2) for d2 in other_values):
-            return values
-        else:
-            return False
+        return self.propagate(values, [(s, values[s] & ~d)])
 
     def eliminate(self, values, s, d):
-        # print('Eliminating {} from {}'.format(d, values[s]))
-        """Eliminate d from values[s]; propagate when values or places <= 2.
+        """Eliminate bit d from values[s] and propagate.
         Return values, except return False if a contradiction is detected."""
-        if d not in values[s]:
-            return values  # Already eliminated
-
-        values[s].remove(d)
-
-        # (1) If a square s is reduced to one value d2, then eliminate d2 from the peers.
-        if len(values[s]) == 0:
-            return False  # Contradiction: removed last value
-        elif len(values[s]) == 1:
-            d2 = values[s][0]
-            if not all(self.eliminate(values, s2, d2) for s2 in self.grid.peers[s]):
-                return False
-
-        # (2) If a unit u is reduced to only one place for a value d, then put it there.
-        for u in self.grid.units[s]:
-            dplaces = [s for s in u if d in values[s]]
-            if len(dplaces) == 0:
-                return False  # Contradiction: no place for this value
-            elif len(dplaces) == 1:
-                if not self.assign(values, dplaces[0], d):
-                    return False
-
-        return values
+        return self.propagate(values, [(s, d)])
+
+    def propagate(self, values, pending):
+        """Remove the (cell, digits) pairs in pending from values, and every
+        candidate that naked and hidden singles then rule out. Work lists
+        replace recursion, so long chains of forced cells cannot overflow the
+        stack: removals are made first, then each (unit, digit) they touched
+        is checked for a hidden single once. Every removal goes on the trail.
+        Return values, except return False if a contradiction is detected."""
+        t = self.topology
+        peers, units, unit_ids = self.peers, t.units, t.cell_unit_ids
+        push = self.trail.append
+        checks = set()  # digit << 8 | unit index
+        check = checks.add
+        removed = 0
+        try:
+            while pending:
+                while pending:
+                    s, ds = pending.pop()
+                    m = values[s]
+                    ds &= m
+                    while ds:
+                        d = ds & -ds
+                        ds ^= d
+
+                        # Move the cell down one bucket.
+                        k = ~popcount(m)
+                        bit = 1 << s
+                        values[k] ^= bit
+                        values[k + 1] |= bit
+                        m = values[s] = m & ~d
+                        push((s, d))
+                        removed += 1
+
+                        # (1) If a square s is reduced to one value, eliminate it from the peers.
+                        if m == 0:
+                            return False  # Contradiction: removed last value
+                        elif m & (m - 1) == 0:
+                            for s2 in peers[s]:
+                                if values[s2] & m:
+                                    pending.append((s2, m))
+
+                        row, col, box = unit_ids[s]
+                        d <<= 8
+                        check(d | row)
+                        check(d | col)
+                        check(d | box)
+
+                # (2) If a unit u is reduced to only one place for a value d, then put it there.
+                for key in checks:
+                    d = key >> 8
+                    dplaces = [s2 for s2 in units[key & 255] if values[s2] & d]
+                    if not dplaces:
+                        return False  # Contradiction: no place for this value
+                    elif len(dplaces) == 1:
+                        other = values[dplaces[0]] & ~d
+                        if other:
+                            self.stats.hidden_singles += 1
+                            pending.append((dplaces[0], other))
+                checks.clear()
+            return values
+        finally:
+            self.budget.propagations += removed
 
-    def assign_to_sigma(self, sigma, domains):
-        if not domains:
+    def assign_to_sigma(self, sigma, values):
+        if not values:
             return False
 
-        for spot in self.grid.spots:
-            sigma[spot] = domains[spot][0]
+        for spot, m in zip(self.topology.spots, values):
+            sigma[spot] = m.bit_length()
 
         return sigma
 
+    def initial_state(self):
+        "The search state after propagating the givens, or False."
+        t = self.topology
+        values = [t.full] * t.cells + [0] * (self.size + 1)
+        values[~self.size] = (1 << t.cells) - 1  # Every cell starts with size candidates
+        for s, d in enumerate(self.grid.givens):
+            if d and not self.assign(values, s, 1 << (d - 1)):
+                return False
+        return values
+
     def initial_assignment(self):
-        for s in self.grid.spots:
-            if len(self.grid.domains[s]) == 1:
-                d = self.grid.domains[s][0]
-                self.grid.domains[s] = range(1, self.size + 1)
-                if not self.assign(self.grid.domains, s, d):
-                    return False
-        return self.grid.domains
+        "The candidates of every cell after propagating the givens, or False."
+        values = self.initial_state()
+        return values and values[:self.cells]
 
-    def consistent(self, sigma, spot, value):
-        for peer in self.grid.peers[spot]:
-            if sigma.get(peer) == value:
-                return False
-        return True
+    def infer(self, values):
+        """Apply the inference rules above singles until none removes anything.
+        Return values, except return False if a contradiction is detected."""
+        stats, budget = self.stats, self.budget
+        while True:
+            before = budget.propagations
+            t = perf_counter()
+            values = self.intersections(values)
+            stats.intersection_time += perf_counter() - t
+            if values and self.level > 1 and budget.propagations == before:
+                t = perf_counter()
+                values = self.pairs(values)
+                stats.pair_time += perf_counter() - t
+            if not values or budget.propagations == before:
+                return values
+
+    def intersections(self, values):
+        """Pointing: a digit whose places in a box all lie on one line is
+        eliminated from the rest of the line. Box-line reduction: a digit whose
+        places on a line all lie in one box is eliminated from the rest of the
+        box."""
+        stats = self.stats
+        for inter, box_rest, line_rest in self.topology.intersections:
+            here = box = line = 0
+            for c in inter:
+                here |= values[c]
+            for c in box_rest:
+                box |= values[c]
+            for c in line_rest:
+                line |= values[c]
+
+            for rest, digits, counter in ((line_rest, here & line & ~box, 'pointing'),
+                                          (box_rest, here & box & ~line, 'box_line')):
+                if not digits:
+                    continue
+                for c in rest:
+                    m = values[c] & digits
+                    while m:
+                        d = m & -m
+                        m ^= d
+                        setattr(stats, counter, getattr(stats, counter) + 1)
+                        if not self.eliminate(values, c, d):
+                            return False
+        return values
+
+    def pairs(self, values):
+        """Naked pairs: two cells of a unit left with the same two digits take
+        those digits from the rest of the unit. Hidden pairs: two digits with
+        the same two places in a unit take those cells for themselves."""
+        stats, size = self.stats, self.size
+        for unit in self.topology.units:
+            seen = {}
+            for c in unit:
+                m = values[c]
+                if popcount(m) == 2:
+                    other = seen.setdefault(m, c)
+                    if other == c:
+                        continue
+                    for c2 in unit:
+                        if c2 != c and c2 != other and values[c2] & m:
+                            stats.naked_pairs += popcount(values[c2] & m)
+                            for d in (m & -m, m & (m - 1)):
+                                if not self.eliminate(values, c2, d):
+                                    return False
+
+            places = [0] * size
+            for i, c in enumerate(unit):
+                m = values[c]
+                if m & (m - 1):
+                    while m:
+                        d = m & -m
+                        m ^= d
+                        places[d.bit_length() - 1] |= 1 << i
+            seen = {}
+            for d, p in enumerate(places):
+                if popcount(p) != 2:
+                    continue
+                other = seen.setdefault(p, d)
+                if other == d:
+                    continue
+                keep = 1 << d | 1 << other
+                for i in (p & -p, p & (p - 1)):
+                    c = unit[i.bit_length() - 1]
+                    m = values[c] & ~keep
+                    stats.hidden_pairs += popcount(m)
+                    while m:
+                        d2 = m & -m
+                        m ^= d2
+                        if not self.eliminate(values, c, d2):
+                            return False
+        return values
 
 
 class SATSolver:
-    def __init__(self, grid, size, filename):
+    """Encodes the puzzle as CNF and hands it to PicoSAT.
+
+    backend='pycosat' (the default) passes the clause list straight to the
+    pycosat binding, with no disk or process I/O. pycosat cannot be stopped
+    mid-solve, so its timeouts are coarse: a slice that has started runs to
+    its end (a few tenths of a second on 36x36); use backend='native' when
+    the timeout is tight. backend='native' solves with
+    the bundled PicoSAT through ctypes (see native.py): one long-lived solver
+    per size holds the static CNF and the givens are passed as assumptions,
+    which is the fastest option for bulk runs. backend='picosat' runs the
+    ./picosat/picosat binary, streaming the DIMACS to its stdin; nothing is
+    written to disk, so any number of these can run at once. save_cnf()
+    writes the formula to cnf/<filename> to inspect or replay it by hand.
+
+    encoding picks how 'at most once per unit' is written: 'pairwise' (the
+    default), or one of the compact 'sequential', 'commander' and 'product'
+    encodings, which add auxiliary variables but need far fewer clauses on
+    25x25 and larger boards (see encoding.py)."""
+
+    BACKENDS = ('pycosat', 'native', 'picosat')
+
+    def __init__(self, grid, size, filename, backend='pycosat', encoding='pairwise',
+                 budget=None):
+        assert backend in self.BACKENDS, 'unknown SAT backend ' + repr(backend)
         self.grid = grid
+        self.topology = grid.topology
+        self.backend = backend
+        self.encoding = encoding
+        self.budget = budget or Budget()
+        self.status = None
+        self.stats = Stats()
         self.cnf_file = 'cnf/' + filename
         self.command = './picosat/picosat'
         self.size = size
@@ -241,85 +652,236 @@ class SATSolver:
 
     @time_deco
     def solve(self):
-        self.encode_problem()
-        self.decode_cnf()
+        self.budget.start()
+        try:
+            self.budget.check()
+            if self.backend == 'native':
+                result = self.solve_incremental()
+            else:
+                cnf = self.encode_problem()
+                if self.backend == 'pycosat':
+                    result = self.solve_in_memory(cnf)
+                else:
+                    result = self.decode_cnf(cnf)
+        except BudgetExceeded:
+            self.status = self.budget.status()
+            return False
+        finally:
+            self.stats.propagations = self.budget.propagations
+
+        self.status = SOLVED if result else UNSOLVABLE
+        return result
+
+    @stats_deco
+    def count(self, limit=2):
+        """Count the solutions, stopping at limit. Each solution found is
+        excluded with a blocking clause over the cell variables and the solver
+        is asked again; the native backend keeps its learned clauses between
+        these calls. sigma holds the first solution found. Return the count,
+        or None if the budget ran out."""
+        self.budget.start()
+        solutions = []
+        try:
+            self.budget.check()
+            if self.backend == 'native':
+                solutions = self.count_incremental(limit)
+            else:
+                cnf = self.encode_problem()
+                while len(solutions) < limit:
+                    if self.backend == 'pycosat':
+                        found = self.solve_in_memory(cnf)
+                    else:
+                        found = self.decode_cnf(cnf)
+                    if not found:
+                        break
+                    model = [self.size * self.topology.index(spot) + d
+                             for spot, d in sorted(self.sigma.items())]
+                    solutions.append(model)
+                    cnf.append([-v for v in model])
+        except BudgetExceeded:
+            self.status = self.budget.status()
+            return None
+        finally:
+            self.stats.propagations = self.budget.propagations
+
+        self.status = SOLVED if solutions else UNSOLVABLE
+        if solutions:
+            self.add_to_sigma(solutions[0])
+        return len(solutions)
+
+    def solve_in_memory(self, cnf):
+        """Solve with pycosat in slices of growing propagation limits. PicoSAT
+        is deterministic and every slice starts over, so a slice only helps if
+        its limit beats the last one. The last slice's time is the estimate:
+        when the next slice cannot finish before the deadline, or only one no
+        bigger than the last would, the solve stops at once."""
+        import pycosat
+
+        budget = self.budget
+        limit = PYCOSAT_SLICE
+        last = None  # (limit, seconds) of the last slice
+        while True:
+            budget.check()
+            if budget.max_propagations is not None:
+                limit = min(limit, budget.max_propagations - budget.propagations)
+                if limit <= (last[0] if last else 0):
+                    budget.stop('propagations')
+            remaining = budget.remaining()
+            if last is not None and remaining is not None:
+                limit = min(limit, int(last[0] * remaining / max(last[1], 1e-6)))
+                if limit <= last[0]:
+                    budget.stop('time')
+
+            t = perf_counter()
+            model = pycosat.solve(chain(cnf, self.template.clauses()),
+                                  prop_limit=limit)
+            elapsed = perf_counter() - t
+            self.stats.solve_time += elapsed
+            if model != 'UNKNOWN':
+                break
+            budget.propagations += limit
+            last = (limit, elapsed)
+            limit *= 2
+
+        if model == 'UNSAT':
+            return False
+
+        t = perf_counter()
+        primary = self.template.primary
+        self.add_to_sigma([v for v in model if 0 < v <= primary])
+        self.stats.parse_time += perf_counter() - t
+        return True
+
+    def solve_incremental(self):
+        """Solve with the long-lived PicoSAT instance of this size. Assumptions
+        do not let PicoSAT simplify its clause database the way unit clauses
+        do, so the givens are first propagated (naked and hidden singles, as in
+        ProSolver) and every literal that fixes is assumed, not just the givens."""
+        from native import incremental_solver
+
+        assumptions = self.assumptions()
+        if assumptions is None:
+            return False
+
+        t = perf_counter()
+        model = incremental_solver(self.size, self.encoding).solve(assumptions,
+                                                                   self.budget)
+        self.stats.solve_time += perf_counter() - t
+        if model is None:
+            return False
+
+        t = perf_counter()
+        self.add_to_sigma(model)
+        self.stats.parse_time += perf_counter() - t
         return True
 
+    def count_incremental(self, limit):
+        from native import incremental_solver
+
+        assumptions = self.assumptions()
+        if assumptions is None:
+            return []
+        return incremental_solver(self.size, self.encoding).count(
+            assumptions, limit, self.budget)
+
+    def assumptions(self):
+        """The literals fixed by propagating the givens, or None if that
+        already shows the puzzle has no solution."""
+        from encoding import cnf_template
+
+        t = perf_counter()
+        values = ProSolver(self.grid, self.size, '').initial_assignment()
+        if not values:
+            return None
+
+        assumptions = []
+        for spot, m in enumerate(values):
+            single = not m & (m - 1)
+            for d in range(self.size):
+                if m >> d & 1:
+                    if single:
+                        assumptions.append(self.size * spot + d + 1)
+                else:
+                    assumptions.append(-(self.size * spot + d + 1))
+
+        template = cnf_template(self.size, self.encoding)
+        self.stats.variables, self.stats.clauses = template.nvars, template.nclauses
+        self.stats.encode_time += perf_counter() - t
+        return assumptions
+
     def add_current(self, cnf):
-        for i in range(self.size):
-            for j in range(self.size):
-                if len(self.grid.domains[(i + 1, j + 1)]) == 1:
-                    spot = self.size * i + j
-                    value = self.size * spot + \
-                        self.grid.domains[(i + 1, j + 1)][0]
-                    cnf.append([value])
-
-    def add_domains(self, cnf):
-        for i in range(self.size):
-            for j in range(self.size):
-                spot = self.size * i + j
-                cnf.append([(self.size * spot) + k +
-                            1 for k in range(self.size)])
-
-    def add_row_constraint(self, cnf):
-        for i in range(self.size):
-            for j in range(self.size):
-                for k in range(self.size):
-                    for m in range(self.size - j - 1):
-                        spot = self.size * i + j
-
-                        value1 = self.size * spot + k + 1
-                        value2 = value1 + self.size * (m + 1)
-
-                        cnf.append([-value1, -value2])
-
-    def add_col_constraint(self, cnf):
-        for i in range(self.size):
-            for j in range(self.size):
-                for k in range(self.size):
-                    for m in range(self.size - i - 1):
-                        spot1 = self.size * i + j
-                        spot2 = self.size * (i + m + 1) + j
-
-                        value1 = self.size * spot1 + k + 1
-                        value2 = self.size * spot2 + k + 1
-
-                        cnf.append([-value1, -value2])
-
-    def add_sqr_constraint(self, cnf):
-        sq = int(sqrt(self.size))
-        # Adding next spots (in same row)
-        for i in range(self.size):
-            for j in range(self.size):
-                for k in range(self.size):
-                    for l in range(i // sq * sq, i // sq * sq + sq):
-                        for m in range(j // sq * sq, j // sq * sq + sq):
-                            spot1 = self.size * i + j
-                            value1 = self.size * spot1 + k + 1
-                            spot2 = self.size * l + m
-                            value2 = self.size * spot2 + k + 1
-                            if value1 != value2:
-                                cnf.append([-value1, -value2])
+        for spot, d in enumerate(self.grid.givens):
+            if d:
+                cnf.append([self.size * spot + d])
 
     def encode_problem(self):
+        """Return the puzzle-specific clauses (one unit clause per given). The
+        rest of the CNF is the static template cached per size in encoding.py."""
+        from encoding import cnf_template
+
+        t = perf_counter()
+        self.template = cnf_template(self.size, self.encoding)
         cnf = []
         self.add_current(cnf)
-        self.add_domains(cnf)
-        self.add_row_constraint(cnf)
-        self.add_col_constraint(cnf)
-        self.add_sqr_constraint(cnf)
-
-        with open(self.cnf_file, 'w') as f:
-            f.write('p cnf {} {} \n'.format(str(self.size ** 3), str(len(cnf))))
-            f.writelines(' '.join(str(e) for e in row) + ' 0\n' for row in cnf)
-
-    def decode_cnf(self):
-        process = Popen([self.command, self.cnf_file], stdout=PIPE)
-        (output, err) = process.communicate()
-        exit_code = process.wait()
-
-        output = self.clean_output(output)
-        self.add_to_sigma(output)
+        self.stats.variables = self.template.nvars
+        self.stats.clauses = self.template.nclauses + len(cnf)
+        self.stats.encode_time += perf_counter() - t
+        return cnf
+
+    def save_cnf(self):
+        "Write the puzzle's complete CNF to cnf/<filename>, for debugging."
+        from encoding import cnf_template
+
+        with open(self.cnf_file, 'wb') as f:
+            f.write(cnf_template(self.size, self.encoding).dimacs_input(self.encode_problem()))
+
+    def decode_cnf(self, cnf):
+        """Run the picosat binary with the DIMACS on its stdin. Return True and
+        fill sigma if it is satisfiable, False if not."""
+        from subprocess import Popen, PIPE, TimeoutExpired
+        from native import SATISFIABLE, UNKNOWN, UNSATISFIABLE
+
+        t = perf_counter()
+        data = self.template.dimacs_input(cnf)
+        self.stats.write_time += perf_counter() - t
+
+        command = [self.command]
+        if self.budget.max_propagations is not None:
+            command += ['-P', str(self.budget.max_propagations)]
+        t = perf_counter()
+        process = Popen(command, stdin=PIPE, stdout=PIPE)
+
+        # Wait in short slices so a deadline or a cancel kills picosat.
+        while True:
+            try:
+                output, _ = process.communicate(data, timeout=0.05)
+                break
+            except TimeoutExpired:
+                data = None  # Already handed over; communicate() carries on writing it
+                try:
+                    self.budget.check()
+                except BudgetExceeded:
+                    process.kill()
+                    process.wait()
+                    raise
+        exit_code = process.returncode  # picosat exits like PicoSAT's solve()
+        self.stats.solve_time += perf_counter() - t
+
+        if exit_code == UNSATISFIABLE:
+            return False
+        elif exit_code != SATISFIABLE:
+            if exit_code == UNKNOWN and self.budget.max_propagations is not None:
+                self.budget.stop('propagations')  # The -P limit was hit
+            raise RuntimeError('picosat exited with code {}'.format(exit_code))
+
+        t = perf_counter()
+        model = self.parse_model(output)
+        if len(model) != self.topology.cells:
+            raise RuntimeError('picosat returned {} true cell variables, expected {}'
+                               .format(len(model), self.topology.cells))
+        self.add_to_sigma(model)
+        self.stats.parse_time += perf_counter() - t
+        return True
 
     def add_to_sigma(self, output):
         for indx, d in enumerate(output):
@@ -328,22 +890,118 @@ class SATSolver:
             d = d % self.size if d % self.size != 0 else self.size
             self.sigma[(i + 1, j + 1)] = d
 
-    def clean_output(self, output):
-        output = output.split(' ')
-        output = [s.strip('\nv') for s in output]
-        output = [int(s) for s in output if s.isdigit() and int(s) > 0]
+    def parse_model(self, output):
+        """The true cell variables in picosat's output, in order. Only positive
+        literals are matched (a space then a digit; negative ones start with
+        '-'), and they come in variable order, so parsing stops at the first
+        auxiliary variable."""
+        primary = self.template.primary
+        model = []
+        for match in POSITIVE.finditer(output):
+            v = int(match.group(1))
+            if v > primary:
+                break
+            model.append(v)
+        return model
+
+
+class DLXSolver:
+    """Exact cover with Dancing Links (Knuth's Algorithm X). The cover matrix
+    is built once per size (see dlx.py); a puzzle covers the rows of its
+    givens and searches what is left."""
+
+    def __init__(self, grid, size, filename, budget=None):
+        self.size = size
+        self.grid = grid
+        self.topology = grid.topology
+        self.budget = budget or Budget()
+        self.status = None
+        self.stats = Stats()
+        self.sigma = {}
 
-        assert len(output) == self.size ** 2
+    @time_deco
+    def solve(self):
+        from dlx import exact_cover
+
+        self.budget.start()
+        try:
+            rows = exact_cover(self.size).solve(self.grid.givens, self.budget,
+                                                self.stats)
+        except BudgetExceeded:
+            self.status = self.budget.status()
+            return False
 
-        return output
+        if rows is None:
+            self.status = UNSOLVABLE
+            return False
 
-    def consistent(self, sigma, spot, value):
-        for peer in self.grid.peers[spot]:
-            if sigma.get(peer) == value:
-                return False
+        for row in rows:
+            cell, d = divmod(row, self.size)
+            self.sigma[self.topology.spots[cell]] = d + 1
+        self.status = SOLVED
         return True
 
 
+class CachingSolver:
+    """Puts a solution cache in front of another solver. The puzzle is
+    reduced to its canonical form under the Sudoku symmetries (see
+    canonical.py); a cached answer is mapped back through the inverse
+    transform, and on a miss the wrapped solver solves the canonical puzzle
+    and its answer is stored. Configure it with functools.partial, e.g.
+    partial(CachingSolver, solver=DLXSolver, cache=SolutionCache(1000))."""
+
+    def __init__(self, grid, size, filename, solver=None, cache=None, budget=None):
+        self.size = size
+        self.grid = grid
+        self.topology = grid.topology
+        self.filename = filename
+        from canonical import solution_cache
+
+        self.solver = solver or ProSolver
+        self.cache = cache or solution_cache()
+        self.budget = budget or Budget()
+        self.status = None
+        self.stats = Stats()
+        self.sigma = {}
+
+    @time_deco
+    def solve(self):
+        from canonical import canonical_form
+
+        self.budget.start()
+        key, transform = canonical_form(self.grid.givens, self.size)
+        found, board = self.cache.lookup(key)
+        if not found:
+            board = self.solve_canonical(key)
+            if self.status != SOLVED and self.status != UNSOLVABLE:
+                return False  # Stopped by the budget; nothing to cache
+            self.cache.store(key, board)
+
+        if board is None:
+            self.status = UNSOLVABLE
+            return False
+
+        self.sigma = dict(zip(self.topology.spots, bytearray(transform.restore(board))))
+        self.status = SOLVED
+        return True
+
+    def solve_canonical(self, key):
+        """Solve the canonical puzzle with the wrapped solver. Return its
+        digits in cell order, or None. The wrapped solver's stats (and node
+        hook) become this solver's."""
+        problem = ''.join(HEX_REP[d] if d else '.' for d in bytearray(key))
+        s = self.solver(Grid(problem, self.size), self.size, self.filename,
+                        budget=self.budget)
+        s.stats.on_node = self.stats.on_node
+        self.stats = s.stats
+        with quiet():
+            _, solved = s.solve()
+        self.status = s.status
+        if not solved:
+            return None
+        return bytes(bytearray(s.sigma[spot] for spot in self.topology.spots))
+
+
 class Sudoku:
     def __init__(self, size=9):
         if size == 9:
@@ -502,6 +1160,7 @@ class Sudoku:
             self.hard = None
 
         self.size = size
+        self.status = None  # The solver status of the last solve()
 
     def solve_all(self, solver, difficulty='all'):
         print('****************************************\n')
@@ -519,44 +1178,30 @@ class Sudoku:
 
     def solve(self, solver, problem, filename):
         print('\n****************************************')
-        if self.size == 9:
-            print("====Problem====")
-        elif self.size == 16:
-            print("=========Problem=========")
+        width = self.size + (topology(self.size).box - 1) * 3
+        print('Problem'.center(width, '='))
         g = Grid(problem, self.size)
         g.display()
         s = solver(g, self.size, filename)
         solved = s.solve()
+        self.status = getattr(s, 'status', None)
         if solved[1]:
-            if self.size == 9:
-                print("====Solution===")
-            elif self.size == 16:
-                print("=========Solution=========")
-            assert all(s.consistent(s.sigma, spot,
-                                    s.sigma[spot]) for spot in s.sigma)
+            from validate import VALID, first_violation
+
+            print('Solution'.center(width, '='))
+            digits = bytearray(s.sigma.get(spot, 0) for spot in topology(self.size).spots)
+            unit = first_violation(digits, g.givens, self.size)
+            assert unit == VALID, 'invalid solution, first_violation() = {}'.format(unit)
             self.display_solution(s.sigma)
+        elif getattr(s, 'status', None) in (TIMEOUT, CANCELLED):
+            print("=======Timed out=========")
+        elif getattr(s, 'status', None) == ERROR:
+            print("=======Failed============")
         else:
             print("=======No solution=======")
 
         return solved[0]
 
     def display_solution(self, d):
-        for i in range(0, self.size):
-            for j in range(0, self.size):
-                s = HEX_REP[d[(i + 1, j + 1)]]
-                print(s, end='')
-                if self.size == 9:
-                    if j == 2 or j == 5:
-                        print(" | ", end='')
-                elif self.size == 16:
-                    if j == 3 or j == 7 or j == 11:
-                        print(" | ", end='')
-            print()
-            if self.size == 9:
-                if i == 2 or i == 5:
-                    print("---------------")
-            elif self.size == 16:
-                if i == 3 or i == 7 or i == 11:
-                    print("-------------------------")
-
+        print_board(self.size, [d[spot] for spot in topology(self.size).spots])
         print('****************************************\n')
@@ -0,0 +1,17 @@
+import decorators
+from batch import solve_batch
+from sudoku import ProSolver, Sudoku, solve_puzzle
+
+decorators.verbose = False
+
+
+def test_batch_matches_search():
+    puzzles = Sudoku(9).easy + Sudoku(9).hard
+    assert list(solve_batch(puzzles)) == [solve_puzzle(p, ProSolver) for p in puzzles]
+
+
+def test_batch_contradiction_and_empty():
+    empty, broken = '.' * 81, '11' + '.' * 79
+    solution, none = solve_batch([empty, broken])
+    assert solve_puzzle(solution, ProSolver) == solution
+    assert none is None
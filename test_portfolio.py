@@ -0,0 +1,31 @@
+import threading
+
+import decorators
+from budget import CANCELLED, TIMEOUT, Budget
+from portfolio import PortfolioSolver
+from sudoku import Grid, Sudoku
+
+decorators.verbose = False
+
+
+def test_cancelled_race():
+    # The naive engine cannot solve a hard 16x16 puzzle before the cancel.
+    budget = Budget()
+    s = PortfolioSolver(Grid(Sudoku(16).hard[0], 16), 16, 'test.cnf', engines=('naive',),
+                        preselect=False, budget=budget)
+    timer = threading.Timer(0.2, budget.cancel)
+    timer.start()
+    try:
+        _, solved = s.solve()
+    finally:
+        timer.cancel()
+    assert not solved
+    assert s.status == CANCELLED
+
+
+def test_race_keeps_node_limit():
+    s = PortfolioSolver(Grid(Sudoku(16).hard[0], 16), 16, 'test.cnf', engines=('naive',),
+                        preselect=False, budget=Budget(max_nodes=100))
+    _, solved = s.solve()
+    assert not solved
+    assert s.status == TIMEOUT
@@ -0,0 +1,25 @@
+import os
+
+import decorators
+from shards import prepare
+from sudoku import Sudoku
+
+decorators.verbose = False
+
+
+def test_malformed_line(tmp_path):
+    puzzles = Sudoku(9).easy[:10]
+    puzzles[5] = puzzles[5][:80]
+    source = tmp_path / 'puzzles.txt'
+    source.write_text(''.join(p + '\n' for p in puzzles))
+
+    run = prepare(str(source), str(tmp_path / 'run'), shard_size=4)
+    assert run.manifest['malformed'] == 1
+    assert run.run(workers=0) == 3
+    assert os.listdir(str(tmp_path / 'run' / 'claims')) == []
+
+    stats = run.merge(str(tmp_path / 'solutions.txt'))
+    assert stats['statuses'] == {'solved': 9, 'error': 1}
+    assert stats['invalid'] == 0
+    solutions = (tmp_path / 'solutions.txt').read_text().split('\n')
+    assert solutions[5] == '' and all(solutions[i] for i in range(10) if i != 5)
@@ -0,0 +1,19 @@
+import decorators
+from budget import SOLVED
+from sudoku import Grid, ProSolver, SATSolver, Sudoku
+
+decorators.verbose = False
+
+
+def test_count_finishes_stats():
+    puzzle = Sudoku(9).hard[0]
+    s = ProSolver(Grid(puzzle, 9), 9, 'test.cnf')
+    assert s.count() == 1
+    assert s.stats.nodes > 0
+    assert s.stats.time > 0
+    assert s.stats.status == SOLVED
+
+    s = SATSolver(Grid(puzzle, 9), 9, 'test.cnf')
+    assert s.count() == 1
+    assert s.stats.time > 0
+    assert s.stats.status == SOLVED
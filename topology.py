@@ -0,0 +1,68 @@
+'''
+Board topology shared by every puzzle of the same size.
+
+Cells are numbered row by row, cell = (i - 1) * size + (j - 1) for the 1-based
+spot (i, j). Everything here depends only on the size, so it is built once and
+shared read-only by Grid and all the solvers.
+'''
+
+from math import sqrt
+
+
+class Topology:
+    def __init__(self, size):
+        x = int(sqrt(size))
+        assert x * x == size, 'size must be a perfect square'
+
+        self.size = size
+        self.box = x
+        self.cells = size * size
+        self.full = (1 << size) - 1  # Bitmask holding every digit
+        self.spots = tuple((i, j) for i in range(1, size + 1)
+                           for j in range(1, size + 1))
+
+        self.rows = tuple(c // size for c in range(self.cells))
+        self.cols = tuple(c % size for c in range(self.cells))
+        self.boxes = tuple(r // x * x + c // x
+                           for r, c in zip(self.rows, self.cols))
+
+        rows = [tuple(r * size + c for c in range(size)) for r in range(size)]
+        cols = [tuple(r * size + c for r in range(size)) for c in range(size)]
+        boxes = [tuple(r * size + c
+                       for r in range(b // x * x, b // x * x + x)
+                       for c in range(b % x * x, b % x * x + x))
+                 for b in range(size)]
+
+        # All 3 * size units: rows first, then columns, then boxes.
+        self.units = tuple(rows + cols + boxes)
+        # The row, column and box unit of every cell.
+        self.cell_units = tuple((rows[r], cols[c], boxes[b])
+                                for r, c, b in zip(self.rows, self.cols, self.boxes))
+        # The indexes in units of the same three units.
+        self.cell_unit_ids = tuple((r, size + c, 2 * size + b)
+                                   for r, c, b in zip(self.rows, self.cols, self.boxes))
+        # Every other cell sharing a unit with the cell.
+        self.peers = tuple(tuple(sorted(set(row + col + sqr) - set([cell])))
+                           for cell, (row, col, sqr) in enumerate(self.cell_units))
+        # Every box crossed with each of its rows and columns, as the cells
+        # (in both, in the box only, on the line only).
+        self.intersections = tuple(
+            (tuple(c for c in sqr if c in line), tuple(c for c in sqr if c not in line),
+             tuple(c for c in line if c not in sqr))
+            for sqr in boxes
+            for line in sorted(set(self.cell_units[c][k] for c in sqr for k in (0, 1))))
+
+    def index(self, spot):
+        return (spot[0] - 1) * self.size + spot[1] - 1
+
+
+_TOPOLOGIES = {}
+
+
+def topology(size):
+    "Return the memoized Topology for boards of the given size."
+    try:
+        return _TOPOLOGIES[size]
+    except KeyError:
+        t = _TOPOLOGIES[size] = Topology(size)
+        return t
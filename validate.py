@@ -0,0 +1,148 @@
+'''
+Solution checks shared by the solvers, the benchmark and bulk runs.
+
+A solution is valid when every row, column and box holds each digit 1..size
+exactly once and every given of the puzzle is kept. check() tests a whole
+batch of grids with NumPy. Each digit becomes one bit of a 64-bit word, and
+ORing the words of a unit gives the full mask exactly when the unit is a
+permutation, because a unit has only size cells. first_violation() and
+valid() run the same checks on one grid in plain Python. NumPy is only
+imported by check(), so validating a single solve keeps the cold start of
+main.py low.
+
+Grids and puzzles are given in cell order as strings in the one-line format,
+as buffers or lists of digits (0 for an empty cell), or as an (N, cells)
+array. A grid that is None (no solution found) fails.
+'''
+
+from sudoku import digit_table, puzzle_size
+from topology import topology
+
+# Grids checked together; bounds memory for large inputs.
+CHUNK = 4096
+
+# first_violation() / check(first=True) results that are not a unit index.
+VALID = -1
+GIVENS = -2  # Every unit is a permutation but a given was changed
+
+
+def _digits(board, size):
+    if isinstance(board, str):
+        return bytearray(board.encode('ascii').translate(digit_table(size)))
+    return board
+
+
+def first_violation(digits, givens=None, size=None):
+    """The index in topology(size).units (rows, then columns, then boxes) of
+    the first unit of one grid that is not a permutation, GIVENS if only a
+    given was changed, or VALID."""
+    if digits is None:
+        return 0
+    size = size or puzzle_size(digits)
+    digits = _digits(digits, size)
+    wanted = set(range(1, size + 1))
+    for k, unit in enumerate(topology(size).units):
+        if set([digits[c] for c in unit]) != wanted:
+            return k
+    if givens is not None:
+        for g, d in zip(_digits(givens, size), digits):
+            if g and g != d:
+                return GIVENS
+    return VALID
+
+
+def valid(digits, givens=None, size=None):
+    "Whether one grid is a solution (of the puzzle givens, if given)."
+    return first_violation(digits, givens, size) == VALID
+
+
+class Validator:
+    "The lookup tables check() needs for one size, built once."
+
+    def __init__(self, size):
+        import numpy as np
+
+        t = topology(size)
+        self.size = size
+        self.cells = t.cells
+        self.full = np.uint64(t.full)
+        self.units = np.array(t.units, dtype=np.intp)           # (3 * size, size)
+        # Digit -> its bit; 0 and digits past the size have none.
+        self.bits = np.zeros(256, dtype=np.uint64)
+        self.bits[1:size + 1] = np.left_shift(np.uint64(1), np.arange(size, dtype=np.uint64))
+
+    def array(self, boards):
+        "The (N, cells) uint8 digit array of a batch of grids or puzzles."
+        import numpy as np
+
+        if isinstance(boards, np.ndarray):
+            return boards.reshape(-1, self.cells).astype(np.uint8, copy=False)
+        chunks = []
+        for b in boards:
+            if b is None:
+                chunks.append(bytes(self.cells))
+            elif isinstance(b, str):
+                chunks.append(b.encode('ascii').translate(digit_table(self.size)))
+            else:
+                chunks.append(bytes(bytearray(b)))
+        data = b''.join(chunks)
+        if len(data) != len(boards) * self.cells:
+            raise ValueError('every board must have {} cells'.format(self.cells))
+        return np.frombuffer(data, dtype=np.uint8).reshape(len(boards), self.cells)
+
+    def check(self, grids, givens=None):
+        "The first_violation() codes of an (N, cells) grid array, as an array."
+        import numpy as np
+
+        masks = np.bitwise_or.reduce(self.bits[grids[:, self.units]], axis=2)
+        bad = masks != self.full                                 # (N, 3 * size)
+        first = np.where(bad.any(axis=1), bad.argmax(axis=1), VALID)
+        if givens is not None:
+            changed = ((givens != 0) & (givens != grids)).any(axis=1)
+            first[changed & (first == VALID)] = GIVENS
+        return first
+
+
+def _size(grids, givens):
+    for boards in (grids, givens if givens is not None else ()):
+        for b in boards:
+            if b is not None:
+                return puzzle_size(b)
+    raise ValueError('no grid to tell the size from')
+
+
+_VALIDATORS = {}
+
+
+def validator(size):
+    "Return the memoized Validator for boards of the given size."
+    try:
+        return _VALIDATORS[size]
+    except KeyError:
+        v = _VALIDATORS[size] = Validator(size)
+        return v
+
+
+def check(grids, givens=None, size=None, first=False):
+    """Check a batch of grids, against their puzzles' givens if given. Return
+    a boolean array, True where the grid is a valid solution. With first,
+    also return the first_violation() code of every grid."""
+    import numpy as np
+
+    if not len(grids):
+        empty = np.zeros(0, dtype=bool)
+        return (empty, np.zeros(0, dtype=np.intp)) if first else empty
+    v = validator(size or _size(grids, givens))
+    grids = v.array(grids)
+    if givens is not None:
+        givens = v.array(givens)
+        if len(givens) != len(grids):
+            raise ValueError('{} grids but {} puzzles'.format(len(grids), len(givens)))
+
+    codes = np.empty(len(grids), dtype=np.intp)
+    for start in range(0, len(grids), CHUNK):
+        end = start + CHUNK
+        codes[start:end] = v.check(grids[start:end],
+                                   None if givens is None else givens[start:end])
+    ok = codes == VALID
+    return (ok, codes) if first else ok